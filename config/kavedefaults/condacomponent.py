@@ -22,6 +22,7 @@ For modifying pip packages, you can create/edit the content of /etc/kave/require
 the contents of requirements.txt in this folder
 """
 import os
+import kaveinstall as li
 from kaveinstall import Component
 from kaveinstall import fromKPMGrepo
 from kaveinstall import linuxVersion
@@ -29,6 +30,12 @@ from kavedefaults.sharedcomponents import epel
 
 
 class Conda(Component):
+    """
+    Installs anaconda with the installer script, then updates it and installs the requirements.
+    options:
+      frompack: first try to unpack a finished tree, packed by another node, from the mirrors or repo
+      publish: local mirror directory to pack the finished tree into, in the repo layout, for other nodes
+    """
 
     def fixstdc(self, fail=True):
         # fix wrong stdc++ linking on ubuntu16
@@ -45,7 +52,23 @@ class Conda(Component):
                     elif fail:
                         raise OSError()
 
+    def packname(self):
+        return self.cname + str(self.python).split('.')[0] + "-pack"
+
     def script(self):
+        if self.options.get("frompack") and self.pack_from is not None:
+            try:
+                self.run("mkdir -p " + self.installDirVersion)
+                self.extract(self.pack_from, self.installDirVersion)
+                li.relocate(self.installDirVersion)
+                self.fixstdc(False)
+                self.buildenv()
+                # updates and requirements are already in the pack
+                self.prebuilt = True
+                return
+            except (RuntimeError, IOError, OSError) as e:
+                print("Could not install from a conda pack, running the installer instead:", e)
+                self.run("rm -rf " + self.installDirVersion)
         dest = "./conda.sh"
         self.copy(self.src_from, dest)
         os.system("chmod a+x " + dest)
@@ -57,35 +80,49 @@ class Conda(Component):
         self.buildenv()
         if '.' in str(self.python):
             # Attempt to update to this python version
-            self.run("bash -c 'source " + self.toolbox.envscript()
-                     + " > /dev/null ; conda update --all python="
-                     + str(self.python) + "  --yes;'")
+            self.runwithenv("conda update --all python=" + str(self.python) + "  --yes")
+
+    def srcdict(self, src):
+        """
+        Complete a logical source, modified to add 2 or 3 to name of file, to match python version for anaconda
+        """
+        if 'filename' not in src:
+            src['filename'] = self.cname + str(self.python).split('.')[0]
+        return Component.srcdict(self, src)
 
     def fillsrc(self):
         """
-        Method to fill the src_from in case it must be logical,
-        modified to add 2 or 3 to name of file, to match python version for anaconda
+        Method to fill the src_from in case it must be logical, and where to find a relocatable pack
         """
-        if self.src_from is None:
-            return False
-        if type(self.src_from) is list:
-            # fill version with self.version if suffix is specified but not version
-            osf = []
-            for s in self.src_from:
-                if type(s) is dict and 'version' not in s and 'suffix' in s:
-                    s['version'] = self.version
-                if type(s) is dict and 'filename' not in s:
-                    s['filename'] = self.cname + str(self.python).split('.')[0]
-                osf.append(s)
-            self.src_from = [fromKPMGrepo(**s) if type(s) is dict else s for s in osf]
-        elif type(self.src_from) is dict:
-            if 'version' not in self.src_from and 'suffix' in self.src_from:
-                self.src_from['version'] = self.version
-            if 'filename' not in self.src_from:
-                self.src_from['filename'] = self.cname + str(self.python).split('.')[0]
-            self.src_from = fromKPMGrepo(**self.src_from)
+        Component.fillsrc(self)
+        if self.options.get("frompack"):
+            self.pack_from = fromKPMGrepo(self.packname(), arch=linuxVersion, version=self.version,
+                                          suffix=".tar.gz")
         return True
 
+    def install(self, kind="node", tmpdir=None, loud=True):
+        """
+        Install as usual, then publish the finished tree as a pack if requested
+        """
+        installed = Component.install(self, kind, tmpdir, loud)
+        if installed and self.options.get("publish") and not self.prebuilt:
+            self.publish(self.options["publish"])
+        return installed
+
+    def publish(self, mirror):
+        """
+        Pack the installed tree into the local mirror directory, where frompack finds it, unless already there
+        """
+        archive = li.repoURL(self.packname() + "-" + self.version + ".tar.gz", repo=mirror,
+                             arch=linuxVersion.lower())
+        if os.path.exists(archive) or not os.path.isdir(self.installDirVersion):
+            return archive
+        if not os.path.isdir(os.path.dirname(archive)):
+            os.makedirs(os.path.dirname(archive))
+        print("Packing", self.installDirVersion, "into", archive)
+        # the downloaded packages are not needed to use the installation
+        return li.packtree(self.installDirVersion, archive, exclude=["pkgs/*.tar.bz2"])
+
 conda = Conda(cname="Anaconda")
 conda.children = {"Centos6": [epel], "Centos7": [epel]}
 conda.pre = {"Centos6": ['yum -y groupinstall "Development Tools" "Development Libraries" "Additional Development"',
@@ -94,10 +131,12 @@ conda.pre["Centos7"] = conda.pre["Centos6"]
 conda.pre["Ubuntu14"] = ["apt-get -y install build-essential g++ libffi* "
                          "libsasl2-dev libsasl2-modules-gssapi-mit* cyrus-sasl2-mit* libgeos-dev"]
 conda.pre["Ubuntu16"] = conda.pre["Ubuntu14"] + ['apt-get -y install libstdc++6 libgl1-mesa-glx']
+conda.requirements = os.path.dirname(os.path.realpath(__file__)) + '/requirements.txt'
+if os.path.exists('/etc/kave/requirements.txt'):
+    conda.requirements = '/etc/kave/requirements.txt'
+# plain pip installs are made through the wheelhouse, see kaveinstall.Wheelhouse
 conda.postwithenv = {"Centos6": ["conda update conda --yes", "conda install pip --yes",
-                                 " if [ -f /etc/kave/requirements.txt ]; "
-                                 "then pip install -r /etc/kave/requirements.txt; "
-                                 "else pip install -r " + os.path.dirname(__file__) + '/requirements.txt; fi',
+                                 "pip install -r " + conda.requirements,
                                  "python -c \"import pandas; import seaborn;\"",  # build font cache
                                  "if type krb5-config 2>&1 > /dev/null; then pip install pykerberos; fi"]}
 conda.postwithenv["Centos7"] = conda.postwithenv["Centos6"]
@@ -107,9 +146,12 @@ conda.doInstall = True
 conda.freespace = 1900
 conda.usrspace = 300
 conda.tempspace = 300
+conda.downloadspace = 300
 conda.installSubDir = "anaconda"
 conda.python = 3
 conda.version = "4.4.0"
+conda.options = {"frompack": True, "publish": None}
+conda.pack_from = None
 conda.src_from = [{"arch": "noarch", "suffix": "-Linux-x86_64.sh"},
                   "https://repo.continuum.io/archive/Anaconda3-4.4.0-Linux-x86_64.sh"]
 conda.env = """
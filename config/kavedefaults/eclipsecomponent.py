@@ -32,12 +32,10 @@ class EclipseComponent(Component):
     """
 
     def script(self):
-        dest = "myeclipse.tar.gz"
-        self.copy(self.src_from, dest)
         # eclipse is massive, so untar directly next to destination folder to save space
         self.run("mkdir -p " + self.installDirVersion.rstrip('/') + '_tmp')
         os.chdir(self.installDirVersion.rstrip('/') + '_tmp')
-        self.run("tar xzf " + self.tmpdir + '/' + dest)
+        self.extract(self.src_from, ".", options="")
         if os.path.exists("eclipse"):
             os.system("mv eclipse " + self.installDirVersion)
         elif os.path.exists("opt/eclipse"):
@@ -65,6 +63,7 @@ eclipse.src_from = {"arch": "noarch", "suffix": ".tar.gz"}
 eclipse.freespace = 500
 eclipse.usrspace = 150
 eclipse.tempspace = 500
+eclipse.downloadspace = 500
 eclipse.env = """
 ecl="%%INSTALLDIRVERSION%%"
 # Allow mixed 1.X/2.X versions
@@ -19,7 +19,7 @@
 """
 pygsl.py module: installs pygsl
 """
-from kaveinstall import Component, mycmd
+from kaveinstall import Component
 from kavedefaults.condacomponent import conda
 
 # ######################  pygsl 2.1 ############################
@@ -52,6 +52,9 @@ gsl2.version = "2.2.0"
 gsl2.src_from = [gsl2.src_from[0],
                  "http://downloads.sourceforge.net/project/pygsl/pygsl/pygsl-2.2.0/pygsl-2.2.0.tar.gz"]
 gsl2.prewithenv["Ubuntu16"] = gsl2.prewithenv["Centos7"]
+# not deep-copied, pygsl needs the real anaconda when installing in parallel
+gsl1.after = [conda]
+gsl2.after = [conda]
 
 # ######################  pygsl parent ############################
 
@@ -59,17 +62,16 @@ gsl2.prewithenv["Ubuntu16"] = gsl2.prewithenv["Centos7"]
 class GslComponent(Component):
 
     def skipif(self):
-        return (conda.installDirVersion in
-                mycmd("bash -c 'source " + self.toolbox.envscript()
-                      + " > /dev/null ; python -c \"import pygsl; print(pygsl.__file__);\" ;'")[1]
-                )
+        return conda.installDirVersion in (self.imports("pygsl")["pygsl"].get("file") or "")
 
 gsl = GslComponent("pygsl")
+gsl.probes = ["pygsl"]
 gsl.doInstall = False
 gsl.pre = {"Centos7": ["yum -y install gsl gsl-devel"],
            "Ubuntu16": ["apt-get -y install build-essential g++ libgsl0-dev gsl-bin libgl1-mesa-glx"]}
 gsl.children = {"Centos7": [gsl1],
                 "Ubuntu16": [gsl2]}
+gsl.after = [conda]
 gsl.tests = [("python -c \"import pygsl;\"", 0, '', '')]
 
 
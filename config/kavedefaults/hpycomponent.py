@@ -20,9 +20,9 @@
 hpy.py module: installs hpy hadoop python modules
 """
 import os
-import subprocess as sub
 import kaveinstall as li
 from kaveinstall import Component
+from kavedefaults.condacomponent import conda
 import __future__
 
 
@@ -61,17 +61,14 @@ class HadoopPy(Component):
             stat, hdv, _err = li.mycmd("hadoop version")
             hdv = '.'.join([l for l in hdv.split('\n') if "Hadoop" in l][0].split(" ")[-1].split('.')[:3])
             for ezmodule in self.options["easy_install"]:
-                self.run(
-                    "bash -c 'source " + self.toolbox.envscript() + " > /dev/null ; export HADOOP_VERSION=" + hdv +
-                    "; export JAVA_HOME=" + jdk + "; export HADOOP_HOME=" + hdh
-                    + "; export CLASSPATH=$CLASSPATH:`hadoop classpath`; easy_install " +
-                    ezmodule + "'")
-            for pipmodule in self.options["pip"]:
-                sub.call(
-                    "bash -c 'source " + self.toolbox.envscript() + " > /dev/null ; export HADOOP_VERSION=" + hdv +
-                    "; export JAVA_HOME=" + jdk + "; export HADOOP_HOME=" + hdh
-                    + "; export CLASSPATH=$CLASSPATH:`hadoop classpath`; pip install " +
-                    pipmodule + "'", shell=True)
+                self.runwithenv(
+                    "export HADOOP_VERSION=" + hdv + "; export JAVA_HOME=" + jdk + "; export HADOOP_HOME=" + hdh
+                    + "; export CLASSPATH=$CLASSPATH:`hadoop classpath`; easy_install " + ezmodule)
+            if self.options["pip"]:
+                # failures are ignored here, the modules which can be installed are
+                self.pipinstall(self.options["pip"], check=False,
+                                prefix="export HADOOP_VERSION=" + hdv + "; export JAVA_HOME=" + jdk
+                                + "; export HADOOP_HOME=" + hdh + "; export CLASSPATH=$CLASSPATH:`hadoop classpath`; ")
         return
 
 
@@ -87,6 +84,7 @@ hpy.pre = {"Centos6": ["yum -y install boost boost-devel openssl-devel"],
            "Ubuntu14": ["apt-get -y install libboost-python-dev libssl-dev"],
            "Ubuntu16": ["apt-get -y install libboost-python-dev libssl-dev"]
            }
+hpy.after = [conda]
 hpy.test = [("python -c \"import mrjob; import pyleus; import pymongo_hadoop;\"", 0, '', '')]
 
 
@@ -27,12 +27,14 @@ import os
 class Kettle(Component):
 
     def script(self):
-        dest = "kettle.zip"
-        self.copy(self.src_from, dest)
-        # kettle is massive, so save space by unpacking directly next to destination
+        # kettle is massive, so save space by downloading and unpacking directly next to destination
+        # a zip cannot be unpacked while it streams in, its table of contents is at the end
         self.run("mkdir -p " + self.installDirVersion.rstrip('/') + '_tmp')
-        self.run("unzip -o -q " + dest + " -d " + self.installDirVersion.rstrip('/') + '_tmp')
         os.chdir(self.installDirVersion.rstrip('/') + '_tmp')
+        dest = "kettle.zip"
+        self.copy(self.src_from, dest)
+        self.run("unzip -o -q " + dest)
+        os.remove(dest)
         # default to our hadoop version
         f = open("data-integration/plugins/pentaho-big-data-plugin/plugin.properties")
         lines = f.read()
@@ -79,9 +81,10 @@ class Kettle(Component):
 
 kettle = Kettle("Kettle")
 kettle.doInstall = False
-kettle.freespace = 700
+kettle.freespace = 1300
 kettle.usrspace = 50
-kettle.tempspace = 600
+kettle.tempspace = 10
+kettle.downloadspace = 600
 kettle.version = "5.4.0.1-130"
 kettle.installSubDir = "kettle"
 kettle.src_from = [{'filename': "pdi-ce", 'suffix': ".zip", 'arch': "noarch"},
@@ -19,7 +19,7 @@
 """
 rcomponent.py module: installs r
 """
-from kaveinstall import Component, mycmd
+from kaveinstall import Component
 from kavedefaults.sharedcomponents import epel, rhrepo
 from kavedefaults.condacomponent import conda
 
@@ -35,13 +35,11 @@ class RComponent(Component):
         return True
 
     def skipif(self):
-        return (conda.installDirVersion in
-                mycmd("bash -c 'source " + self.toolbox.envscript()
-                      + " > /dev/null ; python -c \"import rpy2; print(rpy2.__file__);\" ;'")[1]
-                )
+        return conda.installDirVersion in (self.imports("rpy2")["rpy2"].get("file") or "")
 
 
 r = RComponent("R")
+r.probes = ["rpy2"]
 r.doInstall = True
 r.pre = {"Centos6": ['yum -y groupinstall "Development Tools" "Development Libraries" "Additional Development"',
                      "yum -y install readline-devel",
@@ -62,6 +60,7 @@ r.pre = {"Centos6": ['yum -y groupinstall "Development Tools" "Development Libra
          }
 r.pre["Ubuntu16"] = r.pre["Ubuntu14"]
 r.children = {"Centos6": [epel], "Centos7": [epel, rhrepo]}
+r.after = [conda]
 # Readline issue reported here: https://github.com/ContinuumIO/anaconda-issues/issues/152
 r.postwithenv = {"Centos6": ["conda update conda --yes",
                              "conda remove --yes --force readline",
@@ -22,7 +22,7 @@ root.py module: installs root on top of anaconda :)
 import os
 import sys
 import kaveinstall as li
-from kaveinstall import Component, linuxVersion, mycmd, installfrom, InstallTopDir
+from kaveinstall import Component, linuxVersion, installfrom, InstallTopDir
 from kavedefaults.condacomponent import conda
 
 # Ubuntu14 fix libpng
@@ -53,25 +53,21 @@ class RootComponent(Component):
     ktbpath = os.path.abspath(__file__ + "/../../../")
 
     def script(self):
-        dest = self.tmpdir + "/root-" + root.version + ".tar.gz"
         self.run("mkdir -p " + InstallTopDir + "/" + root.installSubDir)
         self.run("ln -sfT " + root.installSubDir + "-" + root.version + " " +
                  InstallTopDir + "/" + root.installSubDir + "/pro")
-        self.copy(self.src_from, dest)
-        self.run("tar xzf " + dest + " --no-same-owner -C " + InstallTopDir + "/" + root.installSubDir)
+        self.extract(self.src_from, InstallTopDir + "/" + root.installSubDir)
         os.chdir(self.tmpdir)
-        self.run("bash -c 'source " + self.toolbox.envscript() + " > /dev/null && " +
-                 "export ROOTSYS=" + InstallTopDir + "/" + root.installSubDir + "/pro && "
-                 "source \"${ROOTSYS}/bin/thisroot.sh\" && " +
-                 "git clone git://github.com/rootpy/root_numpy.git && " +
-                 "./root_numpy/setup.py install && " +
-                 "git clone https://github.com/ibab/root_pandas.git&& " +
-                 "cd root_pandas && python ./setup.py install" + "'")
+        self.runwithenv("export ROOTSYS=" + InstallTopDir + "/" + root.installSubDir + "/pro && "
+                        "source \"${ROOTSYS}/bin/thisroot.sh\" && " +
+                        "git clone git://github.com/rootpy/root_numpy.git && " +
+                        "./root_numpy/setup.py install && " +
+                        "git clone https://github.com/ibab/root_pandas.git&& " +
+                        "cd root_pandas && python ./setup.py install")
 
     def skipif(self):
         return (conda.installDirVersion in
-                mycmd("bash -c 'source " + self.toolbox.envscript()
-                      + " > /dev/null ; which root ;'")[1]
+                self.withenv("which root")[1]
                 )
 
 root = RootComponent("ROOT")
@@ -117,6 +113,7 @@ root.children = {"Centos6": [glew, glewdev, conda],
 root.freespace = 2048
 root.usrspace = 300
 root.tempspace = 1000
+root.downloadspace = 1000
 root.env = """
 
 export ROOTSYS="/opt/root/pro"
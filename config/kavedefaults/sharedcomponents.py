@@ -114,23 +114,11 @@ class Toolbox(Component):
         return installfrom + os.sep + "scripts" + os.sep + "KaveEnv.sh"
 
     def buildenv(self):
-        prepend = False
-        rest = []
         scriptloc = self.envscript().split()[0]
         # recreate env script in case it totally does not exist, or somehow is missing the intro...
-        if not os.path.exists(scriptloc) and os.path.exists(self.installDirVersion + '/scripts/'):
-            prepend = True
-        elif os.path.exists(scriptloc):
-            f = open(scriptloc)
-            rest = f.readlines()
-            f.close()
-            if not len(rest) > 1:
-                prepend = True
-            elif not rest[0].startswith("#!/bin/bash"):
-                prepend = True
-        if prepend and os.path.exists(os.path.dirname(scriptloc)):
-            f = open(scriptloc, 'w')
-            f.write("""#!/bin/bash
+        if os.path.exists(os.path.dirname(scriptloc)) and (os.path.exists(scriptloc)
+                                                           or os.path.exists(self.installDirVersion + '/scripts/')):
+            li.env_file(scriptloc).header("""#!/bin/bash
 
 # Simple script to set up the KAVE environment
 # called automatically from /etc/profile.d if the installer has
@@ -142,10 +130,7 @@ class Toolbox(Component):
 
 # touch ~/.nokaveBanner to disable printing the banner
 
-"""
-                    )
-            f.write(''.join(rest))
-            f.close()
+""")
         return super(Toolbox, self).buildenv()
 
     def script(self):
@@ -164,6 +149,7 @@ class Toolbox(Component):
         l = f.read()
         f.close()
         l = l.replace("%ENVSCRIPT%", self.installDirPro + '/scripts/KaveEnv.sh')
+        l = l.replace("%COMPILEDENV%", li.compiledenv(self.installDirPro + '/scripts/KaveEnv.sh'))
         # overwrite if it exists
         if not os.access("/etc/profile.d", os.W_OK):
             self.bauk(
@@ -21,24 +21,122 @@ sparkcomponent.py module: installs spark
 """
 import os
 import subprocess as sub
-from kaveinstall import Component, InstallTopDir
+import kaveinstall as li
+from kaveinstall import Component, InstallTopDir, fromKPMGrepo
 from kavedefaults.sharedcomponents import java
 
 
 class SparkComponent(Component):
+    """
+    Installs a prebuilt spark distribution, falling back on building spark from source.
+    options:
+      binary: install from src_from, prebuilt binaries, if False or if that fails build from build_from
+      hadoop: the hadoop version of the prebuilt binaries, put into src_from where it says %%HADOOP%%
+      buildcache: directory keeping the maven repository and the build tools (maven, scala, zinc) between
+                  installs and spark versions, default spark-build in the kaveinstall cache directory, outside
+                  the budget of the artifact cache
+      buildcachesize: MB the build cache may grow to, it is emptied before a build once it is bigger, and
+                      counted as disk space needed when building from source
+      keepzinc: leave the zinc compile server running after a build, to be reused by the next build
+    """
+
+    def usehadoop(self):
+        """
+        Put options["hadoop"] into src_from, not before, so that it can be changed from CustomInstall.py
+        """
+        hadoop = str(self.options.get("hadoop", "2.7"))
+
+        def _fill(src):
+            if type(src) is dict:
+                return dict([(k, v.replace("%%HADOOP%%", hadoop) if isinstance(v, str) else v)
+                             for k, v in src.items()])
+            if isinstance(src, str):
+                return src.replace("%%HADOOP%%", hadoop)
+            return src
+
+        if type(self.src_from) is list:
+            self.src_from = [_fill(s) for s in self.src_from]
+        else:
+            self.src_from = _fill(self.src_from)
+
+    def fillsrc(self):
+        self.usehadoop()
+        Component.fillsrc(self)
+        if self.build_from is None:
+            return True
+        self.build_from = [fromKPMGrepo(**s) if type(s) is dict else s for s in self.build_from]
+        return True
+
+    def mirrorfiles(self):
+        self.usehadoop()
+        return Component.mirrorfiles(self)
+
+    def buildcache(self):
+        if self.options.get("buildcache") is not None:
+            return self.options["buildcache"]
+        if li.__cache_dir__ is None:
+            return None
+        return os.path.join(li.__cache_dir__, "spark-build")
+
+    def diskneeds(self):
+        mounts = Component.diskneeds(self)
+        cache = self.buildcache()
+        if cache is not None and not self.options.get("binary", True):
+            mounts[cache] = mounts.get(cache, 0) + int(self.options.get("buildcachesize", 3000))
+        return mounts
+
+    def cleanbuildcache(self, cache):
+        """
+        Empty the build cache once it is bigger than buildcachesize, maven never removes anything from its repository
+        """
+        size = 0
+        for root, _dirs, names in os.walk(cache):
+            for name in names:
+                if not os.path.islink(os.path.join(root, name)):
+                    size += os.path.getsize(os.path.join(root, name))
+        if size > int(self.options.get("buildcachesize", 3000)) * 1024 ** 2:
+            print("Emptying the spark build cache", cache, "of", size // 1024 ** 2, "MB")
+            self.run("rm -rf " + cache)
 
     def script(self):
-        dest = self.tmpdir + "/spark-" + spark.version + ".tgz"
         self.run("mkdir -p " + InstallTopDir + "/" + self.installSubDir)
         self.run("ln -sfT " + spark.installSubDir + "-" + spark.version + " " +
                  InstallTopDir + "/" + spark.installSubDir + "/pro")
-        self.copy(self.src_from, dest)
-        self.run("tar xzf " + dest + " --no-same-owner -C " + InstallTopDir + "/" + spark.installSubDir)
+        if self.options.get("binary", True):
+            target = InstallTopDir + "/" + spark.installSubDir + "/" + spark.installSubDir + "-" + spark.version
+            try:
+                self.run("mkdir -p " + target)
+                # binary distributions unpack to spark-<version>-bin-<hadoop>
+                self.extract(self.src_from, target, options="--no-same-owner --strip-components=1")
+                return
+            except RuntimeError as e:
+                print("No prebuilt spark available, building from source:", e)
+                self.run("rm -rf " + target)
+        self.extract(self.build_from, InstallTopDir + "/" + spark.installSubDir)
         os.chdir(InstallTopDir + "/" + self.installSubDir + "/pro")
-        self.run("build/mvn -DskipTests -DrecompileMode=all clean package")
+        self.build()
+        return
+
+    def build(self):
+        cache = self.buildcache()
+        if cache is None:
+            self.run("build/mvn -DskipTests -DrecompileMode=all clean package")
+            self.stopzinc()
+            return
+        self.cleanbuildcache(cache)
+        self.run("mkdir -p " + cache + "/m2 " + cache + "/tools")
+        # build/mvn only downloads maven, scala and zinc when missing, and only restarts a running zinc when
+        # it had to download it
+        self.run("cp -rn " + cache + "/tools/. build/")
+        self.run("build/mvn -DskipTests -DrecompileMode=all -Dmaven.repo.local=" + cache + "/m2 clean package")
+        self.run("find build -mindepth 1 -maxdepth 1 -type d \\( -name 'apache-maven-*' -o -name 'scala-*'"
+                 " -o -name 'zinc-*' \\) -exec cp -rn {} " + cache + "/tools/ \\;")
+        if not self.options.get("keepzinc", False):
+            self.stopzinc()
+
+    def stopzinc(self):
         if sub.call(["/usr/bin/pgrep", "-f", "zinc"]) == 0:
             sub.call(["/usr/bin/pkill", "-f", "zinc"])
-        return
 
 spark = SparkComponent("spark")
 spark.doInstall = True
@@ -49,12 +147,17 @@ spark.children = {"Centos7": [java],
                   "Ubuntu16": [java]}
 spark.version = "2.1.1"
 spark.installSubDir = "spark"
-spark.src_from = ["http://archive.apache.org/dist/spark/spark-"
-                  + spark.version + "/spark-" + spark.version + ".tgz"]
+spark.options = {"binary": True, "hadoop": "2.7", "buildcache": None, "buildcachesize": 3000, "keepzinc": False}
+spark.src_from = [{"arch": "noarch", "suffix": "-bin-hadoop%%HADOOP%%.tgz"},
+                  "http://archive.apache.org/dist/spark/spark-" + spark.version + "/spark-" + spark.version
+                  + "-bin-hadoop%%HADOOP%%.tgz"]
+spark.build_from = ["http://archive.apache.org/dist/spark/spark-"
+                    + spark.version + "/spark-" + spark.version + ".tgz"]
 
 spark.freespace = 1900
 spark.usrspace = 1000
 spark.tempspace = 1500
+spark.downloadspace = 1500
 spark.tests = [('which spark-shell > /dev/null', 0, '', ''),
                ('which sparkR > /dev/null', 0, '', ''),
                ('spark-shell --version &> /dev/null', 0, '', ''),
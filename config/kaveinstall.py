@@ -31,11 +31,52 @@ class Component(object), instantiated as Component(name), wrapper for generic in
 import time
 import string
 import os
+import re
 import sys
+import fcntl
 import tempfile
+import json
+import shutil
+import base64
+import hashlib
+import threading
+import contextlib
+import collections
+import io
+import shlex
+import socket
+import fnmatch
 import subprocess as sub
 import multiprocessing
 import __future__
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit, urljoin, unquote
+    from urllib.request import getproxies, proxy_bypass, urlopen, pathname2url
+except ImportError:
+    import httplib
+    from urlparse import urlsplit, urljoin
+    from urllib import unquote, getproxies, proxy_bypass, pathname2url
+    from urllib2 import urlopen
+try:
+    from http.server import SimpleHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
 
 # defaults for the repository
 #
@@ -48,6 +89,44 @@ __main_dir__ = "KaveToolbox"
 __arch__ = "Centos7"
 __mirror_list_file__ = "/etc/kave/mirror"
 __mirror_list__ = []
+# mirrors found on the local network by discover_mirrors, their files are only used where the manifest of the
+# repository itself gives a checksum to check them against
+__discovered_mirrors__ = []
+# persistent cache of downloaded artifacts, and its size limit in bytes, set __cache_dir__ to None to disable
+__cache_dir__ = "/var/cache/kave"
+__cache_budget__ = 20 * 1024 ** 3
+# large downloads are split in chunks of this many bytes, fetched over this many parallel connections
+__download_chunksize__ = 16 * 1024 ** 2
+__download_connections__ = 4
+# remote archives up to this many bytes are unpacked while they download, bigger ones are downloaded first, so
+# that a dropped connection resumes where it stopped instead of starting over on a half unpacked tree
+__stream_size__ = 64 * 1024 ** 2
+# seconds to wait for a server to accept a connection, and for the answer to a HEAD request, so that a dead
+# mirror is passed over quickly, and for the data of a download to keep coming
+__connect_timeout__ = 5
+__read_timeout__ = 30
+# seconds for which a mirror's measured speed is trusted, or for which an unreachable mirror is skipped
+__mirror_ttl__ = 3600
+# file at the top of a mirror listing every file in it, and seconds for which a downloaded copy is trusted
+__manifest_name__ = "kave-manifest.json"
+__manifest_ttl__ = 3600
+# port on which KaveMirror serve answers, over HTTP and to UDP discovery broadcasts, None to not discover mirrors
+__mirror_port__ = 8765
+# directory holding inter-process lock files, only set while installing in parallel
+__lock_dir__ = None
+# commands which must not run concurrently with each other, by lock name
+__locked_commands__ = {"packages": ["yum", "yum-config-manager", "apt-get", "add-apt-repository", "rpm", "dpkg"],
+                       "python": ["conda", "pip", "easy_install"]}
+# file to write a chrome://tracing profile of the install phases to, None to not profile
+__profile__ = None
+# running totals, to attribute work to install phases
+__stats__ = {"subprocesses": 0, "output_lines": 0, "output_bytes": 0}
+# database of the components installed on this host, None to not keep it, and rediscover them every run
+__state_db__ = "/var/lib/kave/state.db"
+# directory to keep the full output of quiet commands in, one log file per component, None to not keep it
+__log_dir__ = None
+# bytes of the end of the stdout and stderr of a quiet command kept in memory, returned and reported on failure
+__output_tail__ = 256 * 1024
 
 
 def repoURL(filename, repo=__repo_url__, arch=__arch__, dir=__main_dir__, ver=None):
@@ -81,20 +160,95 @@ if os.path.exists(__mirror_list_file__):
 #
 
 
-def mycmd(cmd):
-    proc = sub.Popen(cmd, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
-    stdout, stderr = proc.communicate()
-    status = proc.returncode
-    return status, stdout, stderr
+class StreamedCommand(object):
+    """
+    Run a command, reading its output as it arrives rather than all at once at the end.
+    The full output is appended to a log file, if given, and only the last __output_tail__ bytes of stdout
+    and of stderr are kept in memory, so that long builds in quiet mode do not pile up their output.
+    lines and nbytes count the output read so far, for progress reporting while the command runs.
+    """
+
+    def __init__(self, cmd, log=None, tail=None):
+        self.cmd = cmd
+        self.log = log
+        self.tail = tail
+        if self.tail is None:
+            self.tail = __output_tail__
+        self.lines = 0
+        self.nbytes = 0
+        self.status = None
+        self.stdout = b''
+        self.stderr = b''
+        self._lock = threading.Lock()
+        self._logfile = None
+
+    def _read(self, pipe, kept):
+        """
+        Read one pipe to its end, lines longer than 64 kB are read in pieces
+        """
+        size = 0
+        for line in iter(lambda: pipe.readline(64 * 1024), b''):
+            with self._lock:
+                self.lines += 1
+                self.nbytes += len(line)
+                __stats__["output_lines"] += 1
+                __stats__["output_bytes"] += len(line)
+                if self._logfile is not None:
+                    self._logfile.write(line)
+            kept.append(line)
+            size += len(line)
+            while size > self.tail and len(kept) > 1:
+                size -= len(kept.popleft())
+        pipe.close()
+
+    def run(self):
+        """
+        Run the command to its end, returns (status, stdout, stderr) like mycmd, with the ends of the output
+        """
+        __stats__["subprocesses"] += 1
+        if self.log is not None:
+            self._logfile = open(self.log, 'ab')
+            self._logfile.write(("$ " + self.cmd + "\n").encode('utf-8'))
+        try:
+            proc = sub.Popen(self.cmd, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
+            kept = (collections.deque(), collections.deque())
+            stderr = threading.Thread(target=self._read, args=(proc.stderr, kept[1]))
+            stderr.daemon = True
+            stderr.start()
+            self._read(proc.stdout, kept[0])
+            stderr.join()
+            self.status = proc.wait()
+        finally:
+            if self._logfile is not None:
+                self._logfile.close()
+                self._logfile = None
+        self.stdout = b''.join(kept[0])[-self.tail:]
+        self.stderr = b''.join(kept[1])[-self.tail:]
+        return self.status, self.stdout, self.stderr
+
+
+def _full_output(log):
+    if log is None:
+        return ""
+    return "\n full output in: " + log
+
+
+def mycmd(cmd, log=None):
+    """
+    Run a command, returns (status, stdout, stderr), of which only the last __output_tail__ bytes are kept.
+    log: file to append the full output to, see StreamedCommand
+    """
+    return StreamedCommand(cmd, log=log).run()
 
 
-def throw_on_fail_quiet(cmd):
+def throw_on_fail_quiet(cmd, log=None):
     """
     Run a command, if this command fails raise a RuntimeError.
     Do not print the output of the command while it is running
     cmd: the command to run
+    log: file to append the full output to, only the end of it is reported on failure
     """
-    status, output, err = mycmd(cmd)
+    status, output, err = mycmd(cmd, log=log)
     if status:
         # exception for rpm -i if rpm is already installed
         if (status == 1 or status == 256) and cmd.startswith("rpm "):
@@ -104,7 +258,7 @@ def throw_on_fail_quiet(cmd):
             return status
         raise RuntimeError(
             "Problem running: \n" + cmd + "\n got:\n\t" + str(status) +
-            "\n from: \n" + str(output) + " stderr: \n" + str(err))
+            "\n from: \n" + str(output) + " stderr: \n" + str(err) + _full_output(log))
     return output.strip()
 
 
@@ -114,6 +268,7 @@ def throw_on_fail_loud(cmd):
     Echo the progress to stdout while running
     cmd: the command to run
     """
+    __stats__["subprocesses"] += 1
     status = sub.call(cmd, shell=True)
     if status:
         # exception for rpm -i if rpm is already installed
@@ -126,14 +281,15 @@ def throw_on_fail_loud(cmd):
     return status
 
 
-def clean_on_fail_quiet(cmd, directory):
+def clean_on_fail_quiet(cmd, directory, log=None):
     """
     Run a command, if this command fails, remove a directory and raise a RuntimeError
     Do not print the output of the command while it is running
     cmd: the command to run
     directory: the directory to remove
+    log: file to append the full output to, only the end of it is reported on failure
     """
-    status, output, err = mycmd(cmd)
+    status, output, err = mycmd(cmd, log=log)
     if status:
         # exception for rpm -i if rpm is already installed
         if (status == 1 or status == 256) and cmd.startswith("rpm "):
@@ -144,7 +300,7 @@ def clean_on_fail_quiet(cmd, directory):
         if len(directory) > 4:
             os.system("rm -rf " + directory)
         raise RuntimeError("Problem running: \n" + cmd + "\n got:\n\t" +
-                           str(status) + "\n from: \n" + str(output) + " stderr: \n" + str(err))
+                           str(status) + "\n from: \n" + str(output) + " stderr: \n" + str(err) + _full_output(log))
     return output.strip()
 
 
@@ -155,6 +311,7 @@ def clean_on_fail_loud(cmd, directory):
     cmd: the command to run
     directory: the directory to remove
     """
+    __stats__["subprocesses"] += 1
     status = sub.call(cmd, shell=True)
     if status:
         # exception for prm -i if rpm is already installed
@@ -168,46 +325,99 @@ def clean_on_fail_loud(cmd, directory):
 
 
 #
-# Simple helper functions
+# Locking, for when several installer processes run at once
 #
 
-def detect_linux_version():
-    try:
-        status2, output2, err = mycmd("cat /etc/issue")
-        if not status2 and "Ubuntu" in str(output2):
-            if " 14." in str(output2):
-                return "Ubuntu14"
-            if " 16." in str(output2):
-                return "Ubuntu16"
-    except:
-        pass
-    try:
-        status2, output2, err = mycmd("lsb_release -a")
-        if not status2 and "Ubuntu" in str(output2):
-            if " 14." in str(output2):
-                return "Ubuntu14"
-            if " 16." in str(output2):
-                return "Ubuntu16"
-    except:
-        pass
+__held_locks__ = {}
+
+
+@contextlib.contextmanager
+def locked(name):
+    """
+    Hold the named exclusive lock, shared between all installer processes, while running the enclosed block.
+    Does nothing when name is None or when __lock_dir__ is not set, i.e. for a normal serial install.
+    The lock is re-entrant within one process.
+    """
+    if name is None or __lock_dir__ is None or __held_locks__.get(name, 0):
+        if name is not None and name in __held_locks__:
+            __held_locks__[name] += 1
+        try:
+            yield
+        finally:
+            if name is not None and name in __held_locks__:
+                __held_locks__[name] -= 1
+        return
+    lockfile = open(os.path.join(__lock_dir__, '.' + name + '.lock'), 'a')
     try:
-        status3, output3, err = mycmd("cat /etc/redhat-release")
-        if not status3 and "CentOS" in str(output3):
-            if "release 6" in str(output3).lower():
-                return "Centos6"
-            if "release 7" in str(output3).lower():
-                return "Centos7"
-    except:
-        pass
-    status, output, err = mycmd("uname -r")
-    if status:
-        raise RuntimeError("Problem detecting linux version: uname -r got:\n\t" + str(
-            status) + "\n from: \n" + str(output) + " stderr: \n" + str(err))
-    if "el6" in str(output):
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        __held_locks__[name] = 1
+        yield
+    finally:
+        __held_locks__.pop(name, None)
+        fcntl.flock(lockfile, fcntl.LOCK_UN)
+        lockfile.close()
+
+
+def command_lock(cmd):
+    """
+    Name of the lock a shell command needs, see __locked_commands__, or None if it can run concurrently
+    """
+    for name, programs in __locked_commands__.items():
+        pattern = r'(^|[\s;&|(`\'"])(' + '|'.join([re.escape(p) for p in programs]) + r')(\s|$)'
+        if re.search(pattern, cmd):
+            return name
+    return None
+
+
+#
+# Simple helper functions
+#
+
+def detect_linux_version(etc="/etc"):
+    """
+    Recognise the distribution, e.g. Centos7 or Ubuntu16, without starting any subprocess.
+    Reads os-release, issue and redhat-release, and failing those the kernel release (el6/el7), which is returned
+    as-is for unknown distributions. Set KAVE_LINUX_VERSION in the environment to skip the detection, e.g. to
+    evaluate the configuration of another OS.
+    """
+    if os.environ.get("KAVE_LINUX_VERSION"):
+        return os.environ["KAVE_LINUX_VERSION"]
+
+    def _read(name):
+        try:
+            with open(os.path.join(etc, name)) as fp:
+                return fp.read()
+        except (IOError, OSError):
+            return ""
+
+    release = {}
+    for line in _read("os-release").splitlines():
+        if "=" in line:
+            key, value = line.split("=", 1)
+            release[key.strip()] = value.strip().strip('"\'')
+    major = release.get("VERSION_ID", "").split(".")[0]
+    if release.get("ID") == "ubuntu" and major in ["14", "16"]:
+        return "Ubuntu" + major
+    if release.get("ID") == "centos" and major in ["6", "7"]:
+        return "Centos" + major
+    issue = _read("issue")
+    if "Ubuntu" in issue:
+        if " 14." in issue:
+            return "Ubuntu14"
+        if " 16." in issue:
+            return "Ubuntu16"
+    redhat = _read("redhat-release")
+    if "CentOS" in redhat:
+        if "release 6" in redhat.lower():
+            return "Centos6"
+        if "release 7" in redhat.lower():
+            return "Centos7"
+    kernel = os.uname()[2]
+    if "el6" in kernel:
         return "Centos6"
-    elif "el7" in str(output):
+    elif "el7" in kernel:
         return "Centos7"
-    return output
+    return kernel
 
 
 def df(filename, options=[]):
@@ -226,6 +436,23 @@ def df(filename, options=[]):
     return output.split(b"\n")[1].split()
 
 
+def diskfree(filename):
+    """
+    In-process df: returns (device, mount point, free MB, free inodes) of the filesystem holding filename,
+    or which would hold it if it does not exist yet
+    """
+    filename = os.path.realpath(filename)
+    while not os.path.exists(filename) and len(filename) > 1:
+        filename = os.path.realpath(filename + '/../')
+    if not os.path.exists(filename):
+        raise OSError("File does not exist so I cannot check anything for " + filename)
+    mount = filename
+    while not os.path.ismount(mount):
+        mount = os.path.dirname(mount)
+    stat = os.statvfs(filename)
+    return os.stat(filename).st_dev, mount, stat.f_bavail * stat.f_frsize // 1024 ** 2, stat.f_favail
+
+
 def installfrom():
     minstallfrom = os.path.realpath(os.sep.join(__file__.split(os.sep)[:-2]))
     if minstallfrom == "":
@@ -250,30 +477,791 @@ def copymethods(source, destination):
 linuxVersion = detect_linux_version()
 InstallTopDir = "/opt"
 
+#
+# In-process http(s) and ftp client
+#
+
+
+class HTTPTransport(object):
+    """
+    http(s) client keeping a pool of keep-alive connections per host, used for probes and downloads,
+    instead of one curl or wget process (with its own DNS lookup and TLS handshake) per file.
+    Understands login details embedded in the url, like in __repo_url__, the usual proxy environment variables
+    (http_proxy, https_proxy, no_proxy) and follows redirects. ftp urls are handled with urlopen, without pooling.
+
+    bytes, requests, connections and seconds count what was transferred, timings lists (url, bytes, seconds)
+    for each download. Errors are raised as IOError.
+    New connections are given connect_timeout seconds, and HEAD requests answer within it, downloads wait up to
+    timeout seconds for more data.
+    """
+    redirects = 5
+    blocksize = 1024 * 1024
+
+    def __init__(self, timeout=None, connect_timeout=None):
+        if timeout is None:
+            timeout = __read_timeout__
+        if connect_timeout is None:
+            connect_timeout = __connect_timeout__
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.idle = {}
+        self.bytes = 0
+        self.requests = 0
+        self.connections = 0
+        self.seconds = 0.0
+        self.timings = []
+
+    def _count(self, nbytes=0, seconds=0.0, requests=0, connections=0):
+        with self.lock:
+            self.bytes += nbytes
+            self.seconds += seconds
+            self.requests += requests
+            self.connections += connections
+
+    def _connect(self, scheme, host, port):
+        """
+        An idle pooled connection to this server, or a new one, returns (pool key, connection, reused)
+        """
+        proxy = None
+        if not proxy_bypass(host):
+            proxy = getproxies().get(scheme)
+        key = (scheme, host, port, proxy)
+        with self.lock:
+            if self.pid != os.getpid():
+                # forked, the sockets belong to the parent process
+                self.idle = {}
+                self.pid = os.getpid()
+            if len(self.idle.get(key, [])):
+                return key, self.idle[key].pop(), True
+        self._count(connections=1)
+        if proxy is None:
+            if scheme == 'https':
+                return key, httplib.HTTPSConnection(host, port, timeout=self.timeout), False
+            return key, httplib.HTTPConnection(host, port, timeout=self.timeout), False
+        proxy = urlsplit(proxy)
+        headers = {}
+        if proxy.username:
+            headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(
+                (unquote(proxy.username) + ':' + unquote(proxy.password or '')).encode('utf-8')).decode('ascii')
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(proxy.hostname, proxy.port or 80, timeout=self.timeout)
+            conn.set_tunnel(host, port, headers)
+        else:
+            conn = httplib.HTTPConnection(proxy.hostname, proxy.port or 80, timeout=self.timeout)
+            conn.proxy_headers = headers
+        return key, conn, False
+
+    def release(self, response):
+        """
+        Give the connection of a fully-read response back to the pool
+        """
+        key, conn = response.pooled
+        if response.will_close:
+            conn.close()
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                self.idle.setdefault(key, []).append(conn)
+
+    def request(self, method, url, headers=None, follow=True, timeout=None):
+        """
+        Send a request over a pooled connection, returns the response, which has the final url as response.url
+        Read the response completely, then release() it.
+        timeout: seconds to wait for the response, and each read of it, default self.timeout
+        """
+        for _redirect in range(self.redirects + 1):
+            response = self._request(method, url, headers, timeout or self.timeout)
+            if not follow or response.status not in [301, 302, 303, 307, 308]:
+                response.url = url
+                return response
+            response.read()
+            self.release(response)
+            url = urljoin(url, response.getheader('location'))
+        raise IOError("Too many redirects for " + url)
+
+    def _request(self, method, url, headers, timeout):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or {'http': 80, 'https': 443}[scheme]
+        send = {'Connection': 'keep-alive'}
+        if headers is not None:
+            send.update(headers)
+        if parts.username:
+            send['Authorization'] = 'Basic ' + base64.b64encode(
+                (unquote(parts.username) + ':' + unquote(parts.password or '')).encode('utf-8')).decode('ascii')
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        while True:
+            key, conn, reused = self._connect(scheme, parts.hostname, port)
+            target = path
+            if key[-1] is not None and scheme == 'http':
+                # plain http proxies take the full url
+                target = scheme + '://' + parts.hostname + ':' + str(port) + path
+                send.update(conn.proxy_headers)
+            try:
+                if conn.sock is None:
+                    conn.timeout = self.connect_timeout
+                    conn.connect()
+                conn.sock.settimeout(timeout)
+                conn.request(method, target, headers=send)
+                response = conn.getresponse()
+            except (IOError, OSError, httplib.HTTPException) as e:
+                conn.close()
+                if reused:
+                    # the server closed an idle keep-alive connection, try again on a new one
+                    continue
+                raise IOError("Problem requesting " + url + ": " + str(e))
+            self._count(requests=1)
+            response.pooled = (key, conn)
+            return response
+
+    def head(self, url, follow=True):
+        """
+        HEAD request, returns (status, headers dict with lower-case names, seconds taken), within connect_timeout
+        """
+        start = time.time()
+        if url.startswith("ftp:"):
+            try:
+                urlopen(url, timeout=self.connect_timeout).close()
+            except Exception as e:
+                raise IOError("Problem requesting " + url + ": " + str(e))
+            return 200, {}, time.time() - start
+        response = self.request('HEAD', url, follow=follow, timeout=self.connect_timeout)
+        response.read()
+        self.release(response)
+        headers = dict([(k.lower(), v) for k, v in response.getheaders()])
+        return response.status, headers, time.time() - start
+
+    def pipe(self, url, outputs):
+        """
+        Stream a url into a list of open files or pipes at once, so that whatever reads them can start
+        before the download finishes. Returns the number of bytes and their sha256, computed on the way.
+        """
+        start = time.time()
+        if url.startswith("ftp:"):
+            try:
+                response = urlopen(url, timeout=self.timeout)
+            except Exception as e:
+                raise IOError("Problem downloading " + url + ": " + str(e))
+        else:
+            response = self.request('GET', url)
+            if response.status != 200:
+                response.read()
+                self.release(response)
+                raise IOError("Problem downloading " + url + ": got " + str(response.status))
+        nbytes = 0
+        checksum = hashlib.sha256()
+        try:
+            block = response.read(self.blocksize)
+            while block:
+                checksum.update(block)
+                for output in outputs:
+                    output.write(block)
+                nbytes += len(block)
+                block = response.read(self.blocksize)
+        except (IOError, OSError, httplib.HTTPException) as e:
+            response.close()
+            if hasattr(response, 'pooled'):
+                response.pooled[1].close()
+            raise IOError("Problem downloading " + url + ": " + str(e))
+        if hasattr(response, 'pooled'):
+            self.release(response)
+        else:
+            response.close()
+        elapsed = time.time() - start
+        self._count(nbytes, elapsed)
+        with self.lock:
+            self.timings.append((url, nbytes, elapsed))
+        return nbytes, checksum.hexdigest()
+
+    def download(self, url, dest):
+        """
+        Stream a url into the file dest, returns the number of bytes
+        """
+        try:
+            with open(dest, 'wb') as fp:
+                return self.pipe(url, [fp])[0]
+        except (IOError, OSError) as e:
+            if os.path.exists(dest):
+                os.remove(dest)
+            raise IOError(str(e))
+
+    def fetch(self, sources, dest, partial=None, connections=None, chunksize=None):
+        """
+        Download one file, available from a list of alternative sources (mirrors), into dest.
+        Large files from servers accepting byte ranges are fetched in chunks over several connections at once,
+        spreading the chunks over all sources which have the file with the same size. Progress is kept in
+        partial (default dest.part) and partial.json, so an interrupted download resumes where it stopped, if the
+        server identifies the version of the file with an ETag or Last-Modified header.
+        Otherwise falls back to a single stream from the first source which works. Returns the number of bytes.
+        """
+        if type(sources) is not list:
+            sources = [sources]
+        if connections is None:
+            connections = __download_connections__
+        if chunksize is None:
+            chunksize = __download_chunksize__
+        ranged = []
+        size = None
+        tag = None
+        for source in sources:
+            if source.startswith("ftp:"):
+                continue
+            try:
+                status, headers, _elapsed = self.head(source)
+            except IOError:
+                continue
+            if status != 200 or headers.get('accept-ranges') != 'bytes' or 'content-length' not in headers:
+                continue
+            if size is None:
+                size = int(headers['content-length'])
+                tag = headers.get('etag', headers.get('last-modified'))
+                if connections < 2 or size < 2 * chunksize:
+                    break
+            if int(headers['content-length']) == size:
+                ranged.append(source)
+        if len(ranged) and connections > 1 and size >= 2 * chunksize:
+            try:
+                return self._ranged(ranged, dest, partial or dest + '.part', size, tag, connections, chunksize)
+            except IOError as e:
+                print("Parallel download failed,", e, "falling back to a single stream")
+        errors = []
+        for source in sources:
+            try:
+                return self.download(source, dest)
+            except IOError as e:
+                errors.append(str(e))
+        raise IOError("Problem downloading " + dest + " from any source: " + str(errors))
+
+    def _ranged(self, sources, dest, partial, size, tag, connections, chunksize):
+        start = time.time()
+        state = {'size': size, 'tag': tag, 'chunksize': chunksize, 'done': []}
+        try:
+            with open(partial + '.json') as fp:
+                previous = json.load(fp)
+            # without an ETag or Last-Modified nothing says the file did not change since, start over
+            if tag is not None and [previous[k] for k in ['size', 'tag', 'chunksize']] == [size, tag, chunksize]:
+                state = previous
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        if not len(state['done']) or not os.path.exists(partial):
+            state['done'] = []
+            with open(partial, 'wb') as fp:
+                fp.truncate(size)
+        elif len(state['done']):
+            print("Resuming download of", dest, "from", os.path.basename(partial))
+        nchunks = (size + chunksize - 1) // chunksize
+        todo = queue.Queue()
+        for chunk in range(nchunks):
+            if chunk not in state['done']:
+                todo.put((chunk, 0))
+        lock = threading.Lock()
+        errors = []
+
+        def _work():
+            while not len(errors):
+                try:
+                    chunk, attempt = todo.get_nowait()
+                except queue.Empty:
+                    return
+                # spread chunks over the sources, and retry a failed chunk from the next source
+                source = sources[(chunk + attempt) % len(sources)]
+                try:
+                    self._chunk(source, partial, chunk * chunksize, min(size, (chunk + 1) * chunksize) - 1)
+                except IOError as e:
+                    if attempt + 1 < 2 * len(sources):
+                        todo.put((chunk, attempt + 1))
+                        continue
+                    with lock:
+                        errors.append(str(e))
+                    return
+                with lock:
+                    state['done'].append(chunk)
+                    with open(partial + '.json', 'w') as fp:
+                        json.dump(state, fp)
+
+        threads = [threading.Thread(target=_work) for _i in range(min(connections, nchunks))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) or len(set(state['done'])) != nchunks:
+            raise IOError("Problem downloading chunks of " + dest + ": " + str(errors))
+        if partial != dest:
+            if os.path.dirname(os.path.realpath(partial)) == os.path.dirname(os.path.realpath(dest)):
+                os.rename(partial, dest)
+            else:
+                linkorcopy(partial, dest)
+                os.remove(partial)
+        os.remove(partial + '.json')
+        with self.lock:
+            self.timings.append((sources[0], size, time.time() - start))
+        return size
+
+    def _chunk(self, url, path, first, last):
+        """
+        Download the bytes first to last (inclusive) of url into the same place in the file path
+        """
+        start = time.time()
+        response = self.request('GET', url, headers={'Range': 'bytes=%d-%d' % (first, last)})
+        if (response.status != 206
+                or not (response.getheader('content-range') or '').startswith('bytes %d-%d/' % (first, last))):
+            response.close()
+            response.pooled[1].close()
+            raise IOError("Range not served by " + url + ": got " + str(response.status))
+        nbytes = 0
+        try:
+            with open(path, 'r+b') as fp:
+                fp.seek(first)
+                block = response.read(self.blocksize)
+                while block:
+                    fp.write(block)
+                    nbytes += len(block)
+                    block = response.read(self.blocksize)
+        except (IOError, OSError, httplib.HTTPException) as e:
+            response.pooled[1].close()
+            raise IOError("Problem downloading " + url + ": " + str(e))
+        self._count(nbytes, time.time() - start)
+        if nbytes != last - first + 1:
+            response.pooled[1].close()
+            raise IOError("Incomplete range from " + url)
+        self.release(response)
+        return nbytes
+
+
+__http_transport__ = []
+
+
+def http_transport():
+    """
+    The HTTPTransport shared by everything in this installer process
+    """
+    if not len(__http_transport__):
+        __http_transport__.append(HTTPTransport())
+    return __http_transport__[0]
+
+
+def alternatives(source):
+    """
+    The same file on all our remote mirrors which are not known to be down, when source lives on one of them.
+    source itself always comes first.
+    """
+    mirror = mirrorof(source)
+    mirrors = [m if m.endswith('/') else m + '/' for m in __mirror_list__ + [__repo_url__]]
+    if mirror not in mirrors:
+        return [source]
+    others = [m + source[len(mirror):] for m in mirrors if m != mirror and isremote(m)]
+    return [source] + mirror_ranking().order([o for o in others if trusted(o)])
+
+
+def download(source, dest):
+    """
+    Copy any source to dest, raises IOError
+    http(s) and ftp are downloaded in-process, large files in parallel chunks from all mirrors which have them.
+    Partial downloads are kept in the artifact cache, if there is one, so they can be resumed by a later run.
+    Anything else is copied with copymethods().
+    """
+    if isremote(source) and "drive.google" not in source:
+        if not trusted(source):
+            raise IOError("Not downloading " + source + " from a discovered mirror, the repository manifest has no "
+                          "checksum for it")
+        partial = None
+        cache = artifact_cache()
+        if cache is not None:
+            partial = cache.partial(source)
+        size = http_transport().fetch(alternatives(source), dest, partial=partial)
+        expected = manifest_entry(source)
+        if expected is not None and (size != expected['size'] or sha256sum(dest) != expected['sha256']):
+            os.remove(dest)
+            raise IOError("Download of " + source + " does not match the manifest")
+        return size
+    stat, _out, err = mycmd(copymethods(source, dest))
+    if stat or not os.path.exists(dest):
+        raise IOError("Problem copying " + source + ": " + str(err))
+    return os.path.getsize(dest)
+
+
+def remotesize(source):
+    """
+    The size in bytes of a remote source, from the manifest of its mirror or a HEAD request, -1 if unknown
+    """
+    entry = manifest_entry(source)
+    if entry is not None:
+        return entry['size']
+    if source.startswith("ftp:"):
+        return -1
+    try:
+        status, headers, _seconds = http_transport().head(source)
+        if status == 200:
+            return int(headers.get('content-length', -1))
+    except (IOError, ValueError):
+        pass
+    return -1
+
 #
 # How to find our files
 #
 
 
+def mirrorof(source):
+    """
+    The mirror, or failing that the server, a remote source lives on
+    """
+    for mirror in __mirror_list__ + [__repo_url__]:
+        if mirror[-1] != "/":
+            mirror = mirror + "/"
+        if source.startswith(mirror):
+            return mirror
+    return '/'.join(source.split('/')[:3]) + '/'
+
+
+def probe(source):
+    """
+    Check whether a remote source exists, returns (found, reachable, seconds taken)
+    """
+    start = time.time()
+    try:
+        status, _headers, elapsed = http_transport().head(source, follow=False)
+    except IOError:
+        return False, False, time.time() - start
+    return status in [200, 302], True, elapsed
+
+
+class MirrorRanking(object):
+    """
+    Measured health, latency and throughput per mirror, trusted for ttl seconds and kept in a json file (path)
+    so that later lookups and later runs go straight to the fastest live mirror.
+    Mirrors which could not be reached are skipped until their entry expires.
+    """
+    size = 100 * 1024 ** 2  # typical download, to weigh throughput against latency
+
+    def __init__(self, path=None, ttl=None):
+        if ttl is None:
+            ttl = __mirror_ttl__
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as fp:
+                    self.entries = json.load(fp)
+            except (IOError, OSError, ValueError):
+                self.entries = {}
+
+    def key(self, source):
+        mirror = mirrorof(source).split("://")
+        mirror[-1] = mirror[-1].split("@", 1)[-1]
+        return "://".join(mirror)
+
+    def entry(self, source):
+        entry = self.entries.get(self.key(source))
+        if entry is None or time.time() - entry['checked'] > self.ttl:
+            return None
+        return entry
+
+    def score(self, source):
+        """
+        Expected seconds to fetch a typical file from this source's mirror, None if unknown or unhealthy
+        """
+        entry = self.entry(source)
+        if entry is None or not entry['healthy']:
+            return None
+        cost = entry['latency']
+        if entry.get('throughput'):
+            cost += self.size / float(entry['throughput'])
+        return cost
+
+    def order(self, sources):
+        """
+        Sources on known live mirrors first, fastest first, then unknown ones, dropping unreachable mirrors
+        unless that would drop everything
+        """
+        entries = [self.entry(s) for s in sources]
+        alive = [s for s, e in zip(sources, entries) if e is None or e['healthy']]
+        if not len(alive):
+            alive = sources
+        scores = dict([(s, self.score(s)) for s in alive])
+        return sorted(alive, key=lambda s: (scores[s] is None, scores[s] or 0, alive.index(s)))
+
+    def record(self, source, healthy, latency=None, throughput=None):
+        with self.lock:
+            entry = self.entries.setdefault(self.key(source), {'latency': 0.0, 'throughput': None})
+            entry['healthy'] = healthy
+            entry['checked'] = time.time()
+            if latency is not None:
+                entry['latency'] = latency
+            if throughput is not None:
+                entry['throughput'] = throughput
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path + '.' + str(os.getpid()), 'w') as fp:
+                json.dump(self.entries, fp)
+            os.rename(self.path + '.' + str(os.getpid()), self.path)
+        except (IOError, OSError):
+            pass
+
+
+__mirror_ranking__ = []
+
+
+def mirror_ranking():
+    """
+    The MirrorRanking of this run, persisted in the artifact cache directory if there is one
+    """
+    if not len(__mirror_ranking__):
+        path = None
+        if artifact_cache() is not None:
+            path = os.path.join(artifact_cache().directory, 'mirrors.json')
+        __mirror_ranking__.append(MirrorRanking(path))
+    return __mirror_ranking__[0]
+
+
 def failoversources(sources):
     """
-    try a list of locations where a file could be, one after the other
+    find the best location of a file from a list of possible locations
+    local files are taken first, in order. Remote sources are then ordered by the MirrorRanking: a source on the
+    fastest known live mirror is tried alone, otherwise all remote sources are probed concurrently and the fastest
+    which has the file is chosen. Every probe updates the ranking.
     """
     for source in sources:
-        if source is None:
-            continue
-        if source.startswith("ftp:") or (source.startswith("http") and ":" in source):
-            # print "checking "+source
-            stat, stdout, stderr = mycmd("curl -i -I --keepalive-time 5 " + source)
-            if b"200 OK" not in stdout and b"302 Found" not in stdout:
-                # print stdout, stderr, stat
-                continue
-            return source
-        elif os.path.exists(os.path.expanduser(source)):
+        if source is not None and not isremote(source) and os.path.exists(os.path.expanduser(source)):
             return source
+    ranking = mirror_ranking()
+    remote = ranking.order([s for s in sources if s is not None and isremote(s)])
+    if len(remote) and ranking.score(remote[0]) is not None:
+        found, reachable, elapsed = probe(remote[0])
+        ranking.record(remote[0], reachable, elapsed)
+        if found:
+            return remote[0]
+        remote = remote[1:]
+    results = {}
+
+    def _probe(source):
+        results[source] = probe(source)
+
+    threads = [threading.Thread(target=_probe, args=(s,)) for s in remote]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for source, (found, reachable, elapsed) in results.items():
+        ranking.record(source, reachable, elapsed)
+    found = [s for s in remote if results[s][0]]
+    if len(found):
+        return sorted(found, key=lambda s: (ranking.score(s), found.index(s)))[0]
     raise IOError("no available sources detected from the options " + sources.__str__())
 
 
+class RepoManifest(object):
+    """
+    What a mirror holds, read from the __manifest_name__ file at its top, so that one request per mirror replaces
+    probing every file and scraping index pages.
+    files maps each path in the repository layout, <arch>/KaveToolbox/<version>/<file>, to its arch, toolbox
+    version, size, sha256 and, if known, the component it is for. The json file carries the sha256 of its files
+    section, checked when reading it.
+    """
+    format = 1
+
+    def __init__(self, files=None):
+        self.files = files or {}
+
+    def has(self, path):
+        """
+        Is this file, or for a path ending in /, anything in this directory, in the mirror?
+        """
+        if not path.endswith('/'):
+            return path in self.files
+        return len([f for f in self.files if f.startswith(path)]) > 0
+
+    def versions(self, arch="noarch"):
+        """
+        Sorted toolbox versions with files for this arch
+        """
+        return sorted(set([str(e['version']) for e in self.files.values() if e['arch'] == arch]))
+
+    @staticmethod
+    def checksum(files):
+        return hashlib.sha256(json.dumps(files, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    def dumps(self):
+        return json.dumps({'format': self.format, 'files': self.files, 'sha256': self.checksum(self.files)},
+                          indent=1, sort_keys=True)
+
+    @classmethod
+    def loads(cls, text):
+        """
+        Read a manifest, raises ValueError if it is not one or it does not match its checksum
+        """
+        content = json.loads(text)
+        if type(content) is not dict or content.get('format') != cls.format or 'files' not in content:
+            raise ValueError("Not a version " + str(cls.format) + " manifest")
+        if cls.checksum(content['files']) != content.get('sha256'):
+            raise ValueError("Manifest does not match its checksum")
+        return cls(content['files'])
+
+    @staticmethod
+    def entry(path, size, checksum, component=None):
+        entry = {'arch': path.split('/')[0], 'version': path.split('/')[2], 'size': size, 'sha256': checksum}
+        if component is not None:
+            entry['component'] = component
+        return entry
+
+    @classmethod
+    def build(cls, directory, known=None):
+        """
+        The manifest of a directory in the repository layout. The sha256 and component of files in known,
+        {path: {'size', 'sha256', 'component'}}, are taken from there when the size still matches.
+        """
+        known = known or {}
+        files = {}
+        for root, _dirs, names in os.walk(directory):
+            for name in names:
+                path = os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+                parts = path.split('/')
+                if len(parts) < 4 or parts[1] != __main_dir__ or name.endswith('.part'):
+                    continue
+                size = os.path.getsize(os.path.join(root, name))
+                was = known.get(path, {})
+                if was.get('size') == size and was.get('sha256'):
+                    checksum = was['sha256']
+                else:
+                    checksum = sha256sum(os.path.join(root, name))
+                files[path] = cls.entry(path, size, checksum, was.get('component'))
+        return cls(files)
+
+    def write(self, directory):
+        path = os.path.join(directory, __manifest_name__)
+        with open(path + '.' + str(os.getpid()), 'w') as fp:
+            fp.write(self.dumps())
+        os.rename(path + '.' + str(os.getpid()), path)
+
+
+__repo_manifests__ = {}
+
+
+def repo_manifest(mirror):
+    """
+    The RepoManifest of a mirror, or the repository, None if it has none.
+    Fetched once per run, and kept for __manifest_ttl__ seconds in the artifact cache directory, if there is one
+    """
+    if not mirror.endswith('/'):
+        mirror = mirror + '/'
+    if mirror in __repo_manifests__:
+        return __repo_manifests__[mirror]
+    saved = None
+    if isremote(mirror) and artifact_cache() is not None:
+        saved = os.path.join(artifact_cache().directory, 'manifests',
+                             hashlib.sha256(mirror.encode('utf-8')).hexdigest() + '.json')
+    text = None
+    try:
+        if saved is not None and time.time() - os.path.getmtime(saved) < __manifest_ttl__:
+            with open(saved) as fp:
+                text = fp.read()
+    except (IOError, OSError):
+        text = None
+    if text is None:
+        text = ''
+        try:
+            if isremote(mirror):
+                buf = io.BytesIO()
+                http_transport().pipe(mirror + __manifest_name__, [buf])
+                text = buf.getvalue().decode('utf-8')
+            else:
+                with open(os.path.join(os.path.expanduser(mirror), __manifest_name__)) as fp:
+                    text = fp.read()
+        except (IOError, OSError):
+            pass
+        if saved is not None:
+            # also remember that there is no manifest, as an empty file
+            try:
+                if not os.path.isdir(os.path.dirname(saved)):
+                    os.makedirs(os.path.dirname(saved))
+                with open(saved + '.' + str(os.getpid()), 'w') as fp:
+                    fp.write(text)
+                os.rename(saved + '.' + str(os.getpid()), saved)
+            except (IOError, OSError):
+                pass
+    manifest = None
+    if len(text):
+        try:
+            manifest = RepoManifest.loads(text)
+        except ValueError as e:
+            print("Ignoring the manifest of", mirror, ":", e)
+    __repo_manifests__[mirror] = manifest
+    return manifest
+
+
+def manifest_entry(source):
+    """
+    What the manifest of its mirror says about a source, None if the mirror has no manifest or does not list it.
+    Anyone on the network can answer a discovery broadcast, so for discovered mirrors the manifest of the
+    repository is asked instead of their own.
+    """
+    mirror = mirrorof(source)
+    if mirror not in [m if m.endswith('/') else m + '/' for m in __mirror_list__ + [__repo_url__]]:
+        return None
+    manifest = repo_manifest(__repo_url__ if discovered(mirror) else mirror)
+    if manifest is None:
+        return None
+    return manifest.files.get(source[len(mirror):])
+
+
+def discovered(source):
+    """
+    Does a source, or mirror, live on a mirror found by discover_mirrors rather than configured?
+    """
+    return mirrorof(source) in __discovered_mirrors__
+
+
+def trusted(source):
+    """
+    May a source be downloaded: it is not on a discovered mirror, or the repository gives its checksum
+    """
+    return not discovered(source) or manifest_entry(source) is not None
+
+
+def toolbox_versions():
+    """
+    Sorted toolbox versions available from the mirrors and the repository, from their manifests.
+    Mirrors without a manifest are listed: local directories directly, web servers from their index pages.
+    """
+    found = set()
+    for mirror in __mirror_list__ + [__repo_url__]:
+        manifest = repo_manifest(mirror)
+        if manifest is not None:
+            found.update(manifest.versions())
+        elif not isremote(mirror):
+            top = os.path.join(os.path.expanduser(mirror), 'noarch', __main_dir__)
+            if os.path.isdir(top):
+                found.update([d for d in os.listdir(top) if os.path.isdir(os.path.join(top, d))])
+        else:
+            try:
+                response = http_transport().request('GET', repoURL('', repo=mirror, arch='noarch', ver=''))
+                page = response.read().decode('utf-8', 'replace')
+                http_transport().release(response)
+            except IOError:
+                continue
+            found.update([str(v) for v in re.findall(r'href="([^"/]+)/"', page) if v[0].isdigit()])
+    return sorted(found)
+
+
+def repopath(filename, arch=linuxVersion, version=None, suffix=None):
+    """
+    The path in our repository, or any mirror, of the file fromKPMGrepo looks for
+    """
+    if version:
+        filename = filename + '-' + version
+    if suffix:
+        filename = filename + suffix
+    return '/'.join([arch.lower(), __main_dir__, __version__, filename])
+
+
 def fromKPMGrepo(filename, arch=linuxVersion, version=None, suffix=None):
     """
     A very useful function for finding a file in our repository
@@ -291,12 +1279,26 @@ def fromKPMGrepo(filename, arch=linuxVersion, version=None, suffix=None):
     if suffix:
         filename = filename + suffix
     sources = []
-    for mirror in __mirror_list__:
+    for mirror in __mirror_list__ + [__repo_url__]:
         sources.append(repoURL(filename, arch=arch.lower(), repo=mirror))
-
-    sources.append(repoURL(filename, arch=arch.lower()))
+    # mirrors with a manifest say whether they have the file without being asked for it
+    path = repoURL(filename, repo='/', arch=arch.lower())[1:]
+    listed, unknown = [], []
+    for mirror, source in zip(__mirror_list__ + [__repo_url__], sources):
+        if not trusted(source):
+            continue
+        manifest = repo_manifest(mirror)
+        if manifest is None:
+            unknown.append(source)
+        elif manifest.has(path):
+            listed.append(source)
+    local = [s for s in listed if not isremote(s)]
+    if len(local):
+        return local[0]
+    if len(listed) and not len([s for s in unknown if not isremote(s)]):
+        return mirror_ranking().order(listed)[0]
     try:
-        source = failoversources(sources)
+        source = failoversources(unknown + listed)
         return source
     except IOError:
         print(sources, "no file", filename, "found")
@@ -305,32 +1307,1370 @@ def fromKPMGrepo(filename, arch=linuxVersion, version=None, suffix=None):
 
 
 #
-# Main installer class
+# Local artifact cache
 #
 
 
-class Component(object):
+def sha256sum(path, blocksize=1024 * 1024):
     """
-    class wrapper for generic install scripts
-    cname, component name
-    installDir, where to install
-    install() can be overwritten with custom python
-    pre { OS: [] }, prerequisites to the true install, like installing component libraries
-    doInstall, install it or not
-    script(), simple script to run if possible, overwrite with custom python in derived classes
-    any other options variables used in the script, might be either { OS: {"OptName":optval} } or just {"option",
-    "value"}
-    node, install if on a node?
-    src_from, where to get the source from
+    hex sha256 of the content of a file
+    """
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        block = fp.read(blocksize)
+        while block:
+            checksum.update(block)
+            block = fp.read(blocksize)
+    return checksum.hexdigest()
 
+
+def cachekey(source):
+    """
+    The location of a source independent of where it was downloaded from.
+    For our repository and its mirrors this is the repoURL() path <arch>/KaveToolbox/<version>/<file>,
+    for any other url it is the host and path, without protocol and login
     """
+    for mirror in __mirror_list__ + [__repo_url__]:
+        if mirror[-1] != "/":
+            mirror = mirror + "/"
+        if source.startswith(mirror):
+            return source[len(mirror):]
+    key = source.split("://")[-1]
+    return key.split("@", 1)[-1] if "@" in key.split("/")[0] else key
 
-    def __init__(self, cname):
-        self.cname = cname
-        self.loud = True
-        self.pre = {}
-        self.prewithenv = {}
-        self.post = {}
+
+def tarflags(name):
+    """
+    The tar flag to decompress an archive with this name, guessed from the extension
+    """
+    name = name.split('?')[0]
+    for suffixes, flag in [(('.tar.gz', '.tgz'), 'z'), (('.tar.bz2', '.tbz2'), 'j'), (('.tar.xz', '.txz'), 'J')]:
+        if name.endswith(suffixes):
+            return flag
+    return ''
+
+
+def linkorcopy(src, dest):
+    """
+    Hard link src to dest if possible (same filesystem), otherwise copy, replacing dest
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+class ArtifactCache(object):
+    """
+    Persistent, content-addressed cache of downloaded files, shared between installer runs.
+
+    objects/<sha256> holds the file content, index/<sha256 of cachekey(source)>.json records which content
+    belongs to which source. Content is verified against its sha256 before being used.
+    The least recently used objects, and wheels of the wheelhouse, are removed once the total size exceeds budget
+    bytes.
+    """
+
+    def __init__(self, directory=None, budget=None):
+        if directory is None:
+            directory = __cache_dir__
+        if budget is None:
+            budget = __cache_budget__
+        self.directory = directory
+        self.budget = budget
+        for sub_dir in ['objects', 'index', 'partial']:
+            if not os.path.exists(os.path.join(directory, sub_dir)):
+                os.makedirs(os.path.join(directory, sub_dir))
+
+    def partial(self, source):
+        """
+        Where to keep an unfinished download of source, so that a later run can resume it
+        """
+        return os.path.join(self.directory, 'partial',
+                            hashlib.sha256(cachekey(source).encode('utf-8')).hexdigest())
+
+    def _index(self, source):
+        return os.path.join(self.directory, 'index',
+                            hashlib.sha256(cachekey(source).encode('utf-8')).hexdigest() + '.json')
+
+    def lookup(self, source):
+        """
+        Path of the verified cached content of source, or None
+        """
+        try:
+            with open(self._index(source)) as fp:
+                entry = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+        path = os.path.join(self.directory, 'objects', entry['sha256'])
+        if not os.path.exists(path):
+            return None
+        if os.path.getsize(path) != entry['size'] or sha256sum(path) != entry['sha256']:
+            print("Removing corrupt cached copy of", source)
+            os.remove(path)
+            return None
+        os.utime(path, None)
+        return path
+
+    def get(self, source, dest):
+        """
+        Link or copy a cached source to dest, returns False if it is not cached
+        """
+        path = self.lookup(source)
+        if path is None:
+            return False
+        linkorcopy(path, dest)
+        return True
+
+    def put(self, source, path, checksum=None):
+        """
+        Store a downloaded file for source in the cache, then evict old content to stay within budget.
+        Pass the sha256 of the file if it was already computed while downloading.
+        """
+        if checksum is None:
+            checksum = sha256sum(path)
+        obj = os.path.join(self.directory, 'objects', checksum)
+        if not os.path.exists(obj):
+            tmp = obj + '.' + str(os.getpid()) + '.tmp'
+            linkorcopy(path, tmp)
+            os.rename(tmp, obj)
+        index = self._index(source)
+        with open(index + '.tmp', 'w') as fp:
+            json.dump({'key': cachekey(source), 'sha256': checksum, 'size': os.path.getsize(obj)}, fp)
+        os.rename(index + '.tmp', index)
+        os.utime(obj, None)
+        self.evict()
+        return obj
+
+    def entries(self):
+        """
+        (cachekey, size, sha256) of everything in the cache
+        """
+        found = []
+        for name in os.listdir(os.path.join(self.directory, 'index')):
+            try:
+                with open(os.path.join(self.directory, 'index', name)) as fp:
+                    entry = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+            if os.path.exists(os.path.join(self.directory, 'objects', entry['sha256'])):
+                found.append((entry['key'], entry['size'], entry['sha256']))
+        return found
+
+    def _files(self):
+        """
+        (mtime, size, path) of the objects, and of the wheels built into the wheelhouse, which share the budget
+        """
+        files = []
+        for root, _dirs, names in os.walk(os.path.join(self.directory, 'wheels')):
+            files.extend([os.path.join(root, name) for name in names if name.endswith('.whl')])
+        objdir = os.path.join(self.directory, 'objects')
+        files.extend([os.path.join(objdir, name) for name in os.listdir(objdir)])
+        found = []
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def size(self):
+        """
+        Total bytes of all objects and wheels in the cache
+        """
+        return sum([size for _mtime, size, _path in self._files()])
+
+    def evict(self):
+        """
+        Remove the least recently used objects and wheels until the cache fits in its budget,
+        returns the bytes removed
+        """
+        files = self._files()
+        total = sum([f[1] for f in files])
+        removed = 0
+        for _mtime, size, path in sorted(files):
+            if total - removed <= self.budget:
+                break
+            try:
+                os.remove(path)
+                removed += size
+            except OSError:
+                pass
+        return removed
+
+
+__artifact_cache__ = []
+
+
+def artifact_cache():
+    """
+    The ArtifactCache at __cache_dir__, or None if it is disabled or not writable
+    """
+    if __cache_dir__ is None:
+        return None
+    if not len(__artifact_cache__) or __artifact_cache__[0].directory != __cache_dir__:
+        try:
+            cache = ArtifactCache()
+        except (IOError, OSError):
+            return None
+        if not os.access(os.path.join(cache.directory, 'objects'), os.W_OK):
+            return None
+        __artifact_cache__[:] = [cache]
+    return __artifact_cache__[0]
+
+
+class _CacheCopy(object):
+    """
+    Best-effort copy of a stream for the cache, in a file of its own: the first error writing it drops the copy,
+    instead of failing whatever else the stream is going to
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.failed = False
+        try:
+            self.fp = open(path, 'wb')
+        except (IOError, OSError) as e:
+            self.fp = None
+            self.drop(e)
+
+    def write(self, block):
+        if self.fp is None:
+            return
+        try:
+            self.fp.write(block)
+        except (IOError, OSError) as e:
+            self.drop(e)
+
+    def close(self):
+        if self.fp is None:
+            return
+        try:
+            self.fp.close()
+            self.fp = None
+        except (IOError, OSError) as e:
+            self.drop(e)
+
+    def drop(self, error=None):
+        """
+        Give up on the copy, and remove what was written of it
+        """
+        if error is not None and not self.failed:
+            print("Not keeping a copy in the cache,", error)
+        self.failed = True
+        if self.fp is not None:
+            try:
+                self.fp.close()
+            except (IOError, OSError):
+                pass
+            self.fp = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+#
+# Background downloads
+#
+
+__prefetched__ = {}  # source: local path of its background download, see Prefetcher
+
+
+def isremote(source):
+    """
+    Is this source something to download, rather than a local file
+    """
+    return source.startswith("ftp:") or (source.startswith("http") and ":" in source)
+
+
+def prefetched(source, poll=0.5):
+    """
+    Local path of a source downloaded by a Prefetcher, waiting for the transfer if it is still in flight.
+    Returns None if the source was never prefetched, or if the download failed.
+    The state lives in the filesystem, so this also works from forked installer processes.
+    """
+    path = __prefetched__.get(source)
+    if path is None:
+        return None
+    while not os.path.exists(path):
+        if os.path.exists(path + '.failed'):
+            return None
+        time.sleep(poll)
+    return path
+
+
+class Prefetcher(object):
+    """
+    Download the sources of all components to be installed in background threads, ahead of their install.
+    Component.copy() then picks up the finished file, or waits for the transfer still in flight.
+
+    usage: Prefetcher(directory).prefetch(components, kind)
+
+    src_from is resolved up front (fillsrc), in order of installation, children first. What install() is going to
+    skip is not downloaded, see selected().
+    Every alternative in a src_from list maps to the one downloaded file, the first alternative which works.
+    Local sources are not prefetched. Downloads are hard-linked into place, so the prefetched files only take
+    disk space once, but are kept in directory until it is removed.
+    """
+
+    def __init__(self, directory, workers=2):
+        self.directory = directory
+        self.workers = max(int(workers), 1)
+        self.todo = queue.Queue()
+        self.threads = []
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def add(self, sources):
+        """
+        Queue a download for one source, or a list of alternative sources, returns the local path or None
+        """
+        if type(sources) is not list:
+            sources = [sources]
+        sources = [s for s in sources if s is not None and not isinstance(s, dict) and isremote(s)
+                   and s not in __prefetched__]
+        if not len(sources):
+            return None
+        name = sources[0].split("/")[-1].split("?")[0]
+        path = os.path.join(self.directory, str(len(__prefetched__)) + '_' + name)
+        for source in sources:
+            __prefetched__[source] = path
+        self.todo.put((sources, path))
+        return path
+
+    @staticmethod
+    def selected(components, kind="node"):
+        """
+        The components whose sources prefetch downloads, in order of installation, children first: those which
+        will be installed, without those which install() would skip (see Component.willskip) and their children
+        """
+        ordered = [c for c in InstallScheduler(components, kind=kind).components
+                   if c.willinstall(kind) and not c.status]
+        skipped = set()
+
+        def _skip(component):
+            skipped.add(id(component))
+            if component.children is not None:
+                for child in component.children.get(linuxVersion, []):
+                    _skip(child)
+
+        for component in reversed(ordered):
+            if id(component) not in skipped and component.willskip():
+                _skip(component)
+        return [c for c in ordered if id(c) not in skipped]
+
+    def prefetch(self, components, kind="node"):
+        """
+        Resolve the sources of the selected components, then start downloading
+        """
+        for component in self.selected(components, kind):
+            component.fillsrc()
+            if component.src_from is not None:
+                self.add(component.src_from)
+        return self.start()
+
+    def start(self):
+        for _i in range(self.workers - len(self.threads)):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def _work(self):
+        while True:
+            sources, path = self.todo.get()
+            try:
+                for source in sources:
+                    try:
+                        self._fetch(source, path)
+                        break
+                    except Exception as e:
+                        # anything, e.g. a full disk, fails this item only, the worker carries on
+                        print("Prefetch failed,", e, "retry next source")
+                        continue
+                if not os.path.exists(path):
+                    open(path + '.failed', 'w').close()
+            except Exception as e:
+                print("Prefetch of", path, "failed,", e)
+            finally:
+                self.todo.task_done()
+
+    @staticmethod
+    def _fetch(source, path):
+        cache = artifact_cache()
+        if cache is not None and cache.get(source, path + '.part'):
+            os.rename(path + '.part', path)
+            return
+        download(source, path + '.part')
+        if cache is not None:
+            try:
+                cache.put(source, path + '.part')
+            except (IOError, OSError) as e:
+                print("Could not cache", source, ",", e)
+        os.rename(path + '.part', path)
+
+    def wait(self):
+        """
+        Block until all queued downloads are finished
+        """
+        self.todo.join()
+
+
+#
+# Profiling
+#
+
+
+class Profiler(object):
+    """
+    Records the phases of installing each component, with their wall time, bytes downloaded and subprocesses
+    started, as complete events in the chrome trace-event format (load the result in chrome://tracing).
+    Every process appends to its own event file, so that components installed in parallel forks are all
+    recorded, write() merges them into the trace.
+    Work done in background threads, e.g. prefetching, counts towards whichever phase is running.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.realpath(path)
+        self.lock = threading.Lock()
+
+    def _events(self):
+        return self.path + '.' + str(os.getpid()) + '.events'
+
+    def record(self, component, name, start, end, nbytes, subprocesses, failed=False):
+        event = {"name": name, "cat": component, "ph": "X", "ts": int(start * 1e6), "dur": int((end - start) * 1e6),
+                 "pid": os.getpid(), "tid": threading.current_thread().ident % 100000,
+                 "args": {"component": component, "bytes": nbytes, "subprocesses": subprocesses}}
+        if failed:
+            event["args"]["failed"] = True
+        with self.lock:
+            with open(self._events(), 'a') as fp:
+                fp.write(json.dumps(event) + '\n')
+        return event
+
+    def write(self):
+        """
+        Merge the events of all processes into the trace file, returns the list of events
+        """
+        events = []
+        directory, base = os.path.split(self.path)
+        for name in os.listdir(directory):
+            if name.startswith(base + '.') and name.endswith('.events'):
+                with open(os.path.join(directory, name)) as fp:
+                    events = events + [json.loads(line) for line in fp if line.strip()]
+                os.remove(os.path.join(directory, name))
+        events.sort(key=lambda e: e["ts"])
+        with open(self.path + '.tmp', 'w') as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+        os.rename(self.path + '.tmp', self.path)
+        return events
+
+    @staticmethod
+    def summary(events, top=20):
+        """
+        Print a table of the slowest phases, slowest first
+        """
+        events = sorted(events, key=lambda e: -e["dur"])[:top]
+        print("%-24s %-18s %10s %10s %6s" % ("Component", "Phase", "Seconds", "MB", "Procs"))
+        for e in events:
+            name = e["name"] + ("(failed)" if "failed" in e["args"] else "")
+            print("%-24s %-18s %10.1f %10.1f %6d" % (e["cat"][:24], name[:18], e["dur"] / 1e6,
+                                                     e["args"]["bytes"] / 1024. ** 2, e["args"]["subprocesses"]))
+
+
+class InstallTimings(object):
+    """
+    How long the last few installs of each component version took on this host, kept in a json file (path),
+    to estimate how long the next one will take
+    """
+    keep = 5
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def key(component):
+        return component.cname + ' ' + str(component.version)
+
+    def record(self, component, seconds):
+        with locked("timings"):
+            self.entries = self._load()
+            self.entries[self.key(component)] = (self.entries.get(self.key(component), []) + [seconds])[-self.keep:]
+            if self.path is None:
+                return
+            try:
+                with open(self.path + '.' + str(os.getpid()), 'w') as fp:
+                    json.dump(self.entries, fp)
+                os.rename(self.path + '.' + str(os.getpid()), self.path)
+            except (IOError, OSError):
+                pass
+
+    def estimate(self, component):
+        """
+        Expected seconds to install component, None if it was never installed here
+        """
+        seconds = self.entries.get(self.key(component))
+        if not seconds:
+            return None
+        return sum(seconds) / float(len(seconds))
+
+
+__install_timings__ = []
+
+
+def install_timings():
+    """
+    The InstallTimings of this host, persisted in the artifact cache directory if there is one
+    """
+    if not len(__install_timings__):
+        path = None
+        if artifact_cache() is not None:
+            path = os.path.join(artifact_cache().directory, 'timings.json')
+        __install_timings__.append(InstallTimings(path))
+    return __install_timings__[0]
+
+
+__profiler__ = []
+# seconds spent in each phase, by component name, for the state database
+__phase_seconds__ = {}
+
+
+def profiler():
+    """
+    The Profiler writing to __profile__, or None if not profiling
+    """
+    if __profile__ is None:
+        return None
+    if not len(__profiler__) or __profiler__[0].path != os.path.realpath(__profile__):
+        __profiler__[:] = [Profiler(__profile__)]
+    return __profiler__[0]
+
+
+@contextlib.contextmanager
+def phase(component, name):
+    """
+    Record the enclosed block as one phase of installing a component, its seconds are added up in
+    __phase_seconds__, and everything else is recorded if profiling
+    """
+    prof = profiler()
+    start = time.time()
+    if prof is None:
+        try:
+            yield
+        finally:
+            phases = __phase_seconds__.setdefault(component, {})
+            phases[name] = phases.get(name, 0.0) + time.time() - start
+        return
+    nbytes = http_transport().bytes
+    subprocesses = __stats__["subprocesses"]
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        phases = __phase_seconds__.setdefault(component, {})
+        phases[name] = phases.get(name, 0.0) + time.time() - start
+        prof.record(component, name, start, time.time(), http_transport().bytes - nbytes,
+                    __stats__["subprocesses"] - subprocesses, failed)
+
+
+#
+# Login environment
+#
+
+# variables of the clean shell in which the environment script is compiled, see compileenv
+__clean_env__ = {"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin", "TERM": "dumb",
+                 "HOME": "/nonexistent", "LANG": "C"}
+__shell_vars__ = ["PWD", "OLDPWD", "SHLVL", "_"]
+
+
+class EnvFile(object):
+    """
+    In-memory model of an environment script such as KaveEnv.sh: free text, plus one block per component
+    between '## Begin <name>' and '## End <name>' lines.
+    The file is only read again if it changed on disk since this process last read or wrote it, e.g. from a parallel
+    install, and only written when the content changes, atomically, so that logins never see a half-written script.
+    Writing removes the precompiled snapshot of the script, see compileenv.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.segments = []  # [name or None, text], name None for text outside blocks
+        self.signature = None
+        self.digest = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def _digest(text):
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        return hashlib.sha256(text).hexdigest()
+
+    def _load(self):
+        self.segments = []
+        content = ""
+        if os.path.exists(self.path):
+            with open(self.path) as fp:
+                content = fp.read()
+        self.digest = self._digest(content)
+        self.signature = self._stat()
+        block = None
+        for line in content.splitlines(True):
+            if block is None and line.strip().startswith("## Begin "):
+                block = [line.strip()[len("## Begin "):], ""]
+                self.segments.append(block)
+            elif block is not None and line.strip() == "## End " + block[0]:
+                block = None
+            elif block is not None:
+                block[1] += line
+            elif len(self.segments) and self.segments[-1][0] is None:
+                self.segments[-1][1] += line
+            else:
+                self.segments.append([None, line])
+
+    def refresh(self):
+        """
+        Read the file again if it changed on disk
+        """
+        if self.signature is None or self._stat() != self.signature:
+            self._load()
+
+    def render(self):
+        text = ""
+        for name, content in self.segments:
+            if name is None:
+                text += content
+            else:
+                text += "## Begin " + name + "\n" + content + "## End " + name + "\n"
+        return text
+
+    def __contains__(self, name):
+        return name in [n for n, _c in self.segments if n is not None]
+
+    def header(self, text):
+        """
+        Put text at the start of the script, unless it already starts with a shebang
+        """
+        with locked("env"):
+            self.refresh()
+            if not self.render().startswith("#!/bin/bash"):
+                self.segments.insert(0, [None, text])
+                return self.write()
+        return False
+
+    def set(self, name, content):
+        """
+        Replace the block of name with content, or add it at the end
+        """
+        with locked("env"):
+            self.refresh()
+            for segment in self.segments:
+                if segment[0] == name:
+                    segment[1] = content
+                    break
+            else:
+                text = self.render()
+                if len(text) and not text.endswith("\n"):
+                    self.segments.append([None, "\n"])
+                self.segments.append([name, content])
+            return self.write()
+
+    def write(self):
+        """
+        Write the script if its content changed, returns whether it did
+        """
+        text = self.render()
+        digest = self._digest(text)
+        if digest == self.digest and self.signature is not None:
+            return False
+        tmp = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as fp:
+            fp.write(text)
+        if os.path.exists(self.path):
+            shutil.copymode(self.path, tmp)
+        os.rename(tmp, self.path)
+        self.digest = digest
+        self.signature = self._stat()
+        if os.path.exists(compiledenv(self.path)):
+            os.remove(compiledenv(self.path))
+        return True
+
+
+__env_files__ = {}
+
+
+def env_file(path):
+    """
+    The EnvFile model of the environment script at path, shared by all components
+    """
+    path = os.path.realpath(path)
+    if path not in __env_files__:
+        __env_files__[path] = EnvFile(path)
+    return __env_files__[path]
+
+
+def compiledenv(script):
+    """
+    Where the precompiled snapshot of an environment script lives
+    """
+    return os.path.splitext(script.split()[0])[0] + '.compiled.sh'
+
+
+def _sourced(script, env):
+    __stats__["subprocesses"] += 1
+    proc = sub.Popen(["bash", "-c", "source " + script + " > /dev/null 2>&1; env -0"], env=env,
+                     stdout=sub.PIPE, stderr=sub.PIPE)
+    stdout, _stderr = proc.communicate()
+    if proc.returncode:
+        raise RuntimeError("Problem sourcing " + script)
+    stdout = stdout.decode('utf-8')
+    return dict([v.split('=', 1) for v in stdout.split('\0') if '=' in v])
+
+
+def _quoted(value):
+    for char in '\\"$`':
+        value = value.replace(char, '\\' + char)
+    return '"' + value + '"'
+
+
+def compileenv(script, dest=None):
+    """
+    Flatten an environment script into a snapshot of literal exports, so that logins do not have to run
+    every component's fragment, ls, thisroot.sh and so on.
+    The script is sourced twice in a clean shell: once as a fresh login, and once with every variable it touches
+    already set to a placeholder, which shows whether it prepends, appends or overwrites. Prepending and appending
+    stays relative to the user's own value, e.g. export PATH="/opt/root/pro/bin:${PATH}".
+    The snapshot is invalidated by Component.buildenv, and a login only uses it while it is newer than the script.
+    Returns the path of the snapshot.
+    """
+    if dest is None:
+        dest = compiledenv(script)
+    fresh = _sourced(script, __clean_env__)
+    marked = dict(__clean_env__)
+    fresh = dict([(k, v) for k, v in fresh.items() if k not in __shell_vars__ and not k.startswith("BASH_FUNC_")])
+    for var in fresh:
+        if fresh[var] != __clean_env__.get(var):
+            marked[var] = marked.get(var, "") + ("" if var not in marked else ":") + "KAVE_PLACEHOLDER_" + var
+    rerun = _sourced(script, marked)
+    directory = os.path.dirname(os.path.realpath(script.split()[0]))
+    lines = ["#!/bin/bash", "# Generated from " + script + " by the KAVE installer, do not edit.",
+             "# Any change to the environment script removes it, and it is ignored if older than the script.", "",
+             'if [ "$TERM" != "dumb" ] && [ ! -e "$HOME"/.nokaveBanner ] && [ -e %s ]; then' % _quoted(
+                 os.path.join(os.path.dirname(directory), "Welcome.banner")),
+             "\tcat %s" % _quoted(os.path.join(os.path.dirname(directory), "Welcome.banner")),
+             "fi"]
+    for var in sorted(fresh):
+        if fresh[var] == __clean_env__.get(var):
+            continue
+        value = rerun.get(var, "")
+        if marked[var] not in value:
+            lines.append("export " + var + "=" + _quoted(fresh[var]))
+            continue
+        template = _quoted(value).replace(marked[var], "${" + var + "}")
+        if var in __clean_env__:
+            # the user's own value must be there, and was included in the fresh login
+            guard = _quoted(value.replace(marked[var], "")).strip('"').strip(':')
+            lines.append('if [[ ":${%s}:" != *%s* ]]; then' % (var, _quoted(":" + guard + ":")))
+            lines.append("\texport " + var + "=" + template)
+            lines.append("fi")
+            continue
+        lines.append('if [ -z "${%s}" ]; then' % var)
+        lines.append("\texport " + var + "=" + _quoted(fresh[var]))
+        lines.append('elif [[ ":${%s}:" != *%s* ]]; then' % (var, _quoted(":" + fresh[var].strip(':') + ":")))
+        lines.append("\texport " + var + "=" + template)
+        lines.append("fi")
+    with open(dest + '.tmp', 'w') as fp:
+        fp.write('\n'.join(lines) + '\n')
+    os.chmod(dest + '.tmp', 0o755)
+    os.rename(dest + '.tmp', dest)
+    return dest
+
+
+def envlatency(script, repeat=5):
+    """
+    Median seconds a login shell spends sourcing an environment script
+    """
+    timings = []
+    for _i in range(repeat):
+        start = time.time()
+        _sourced(script, dict(os.environ))
+        timings.append(time.time() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+#
+# Commands which need the environment
+#
+
+
+class EnvSession(object):
+    """
+    A long-lived bash which has sourced an environment script once, to run many commands in that environment
+    without sourcing it again for each, as bash -c 'source <script> > /dev/null ; <cmd>' would.
+    Each command runs in its own subshell, from the current directory, with no stdin, so commands cannot affect
+    each other. The command output is framed by a marker line carrying its exit status.
+    The session restarts, sourcing the script again, when the script has changed on disk.
+    """
+
+    def __init__(self, script):
+        self.script = script
+        self.proc = None
+        self.signature = None
+        self.marker = "__KAVE_STATUS_" + base64.b16encode(os.urandom(8)).decode('ascii') + "__"
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.script.split()[0])
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime
+
+    def start(self):
+        self.close()
+        __stats__["subprocesses"] += 1
+        self.signature = self._signature()
+        # stderr is not read, commands send theirs to a file or straight to the terminal
+        self.proc = sub.Popen(["bash", "--noprofile", "--norc"], stdin=sub.PIPE, stdout=sub.PIPE)
+        self._send("source " + self.script + " > /dev/null ; ", ":", "")
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                self.proc.stdin.close()
+            except (IOError, OSError):
+                pass
+            self.proc.wait()
+        self.proc = None
+
+    def _send(self, prefix, cmd, redirect, loud=False, log=None):
+        """
+        Send one framed command and read its output up to the marker line, returns (status, stdout).
+        If not loud, the output is appended to log, an open file, if given, and only its last __output_tail__
+        bytes are kept, like StreamedCommand does.
+        """
+        self.proc.stdin.write((prefix + "( " + cmd + "\n) < /dev/null" + redirect
+                               + " ; printf '\\n%s %d\\n' " + self.marker + " $?\n").encode('utf-8'))
+        self.proc.stdin.flush()
+        kept = collections.deque()
+        size = 0
+        # the framing adds a newline so that the marker is always on a line of its own, hold back one line
+        pending = None
+        while True:
+            raw = self.proc.stdout.readline(64 * 1024)
+            if not raw:
+                self.proc = None
+                raise RuntimeError("Environment session ended unexpectedly while running: " + cmd)
+            line = raw
+            if not isinstance(line, str):
+                line = line.decode('utf-8', 'replace')
+            if line.startswith(self.marker + " "):
+                status = int(line.split()[-1])
+                break
+            if pending is not None:
+                size = self._output(pending, loud, kept, size, log)
+            pending = (line, raw)
+        if pending is not None:
+            self._output((pending[0][:-1], pending[1][:-1]), loud, kept, size, log)
+        return status, ''.join(kept)[-__output_tail__:]
+
+    @staticmethod
+    def _output(output, loud, kept, size, log):
+        """
+        Print some output, (text, raw bytes), if loud, otherwise log it and add it to the kept tail of size
+        characters, returns the new size
+        """
+        text, raw = output
+        if loud:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            return size
+        __stats__["output_lines"] += 1
+        __stats__["output_bytes"] += len(raw)
+        if log is not None:
+            log.write(raw)
+        kept.append(text)
+        size += len(text)
+        while size > __output_tail__ and len(kept) > 1:
+            size -= len(kept.popleft())
+        return size
+
+    def run(self, cmd, loud=False, log=None):
+        """
+        Run a command in the environment, returns (status, stdout, stderr) like mycmd, with the ends of the output.
+        If loud, the output is printed as it arrives instead of returned.
+        log: file to append the full output to, if not loud
+        """
+        if self.proc is None or self.proc.poll() is not None or self._signature() != self.signature:
+            self.start()
+        prefix = "cd " + quote(os.getcwd()) + " && "
+        if loud:
+            status, output = self._send(prefix, cmd, "", loud=True)
+            return status, "", ""
+        errfile = tempfile.mkstemp(prefix="kave_session_")
+        os.close(errfile[0])
+        logfile = None
+        try:
+            if log is not None:
+                logfile = open(log, 'ab')
+                logfile.write(("$ " + cmd + "\n").encode('utf-8'))
+            status, output = self._send(prefix, cmd, " 2> " + quote(errfile[1]), log=logfile)
+            with open(errfile[1], 'rb') as fp:
+                if logfile is not None:
+                    shutil.copyfileobj(fp, logfile)
+                fp.seek(max(os.path.getsize(errfile[1]) - __output_tail__, 0))
+                err = fp.read().decode('utf-8', 'replace')
+        finally:
+            if logfile is not None:
+                logfile.close()
+            os.remove(errfile[1])
+        return status, output, err
+
+
+__env_sessions__ = {}
+
+
+def env_session(script):
+    """
+    The EnvSession for an environment script, one per process
+    """
+    key = (os.getpid(), script)
+    if key not in __env_sessions__:
+        __env_sessions__[key] = EnvSession(script)
+    return __env_sessions__[key]
+
+
+#
+# Probing python imports
+#
+
+# run by probe_imports with the modules to import as arguments, prints what it found as json on its last line
+__import_probe__ = """
+import json, sys
+found = {}
+for name in sys.argv[1:]:
+    try:
+        module = __import__(name)
+        for part in name.split('.')[1:]:
+            module = getattr(module, part)
+        found[name] = {'ok': True, 'file': getattr(module, '__file__', None),
+                       'version': str(getattr(module, '__version__', '')) or None}
+    except Exception as e:
+        found[name] = {'ok': False, 'error': type(e).__name__ + ': ' + str(e)}
+sys.stdout.write('\\n' + json.dumps(found) + '\\n')
+"""
+# what probe_imports found, by environment script, then module
+__probed_imports__ = {}
+
+
+def probe_imports(modules, script=None):
+    """
+    Import python modules in one interpreter, started in the environment of script (see EnvSession) if given,
+    returns {module: {'ok': True, 'file', 'version'} or {'ok': False, 'error'}}.
+    Answers are kept until forget_imports(), so asking for all modules once and then for each one costs one
+    interpreter. If the interpreter dies without answering, e.g. an import crashes it, each module is tried alone.
+    """
+    known = __probed_imports__.setdefault(script, {})
+    todo = []
+    for module in modules:
+        if module not in known and module not in todo:
+            todo.append(module)
+    if len(todo):
+        known.update(_probe_imports(todo, script))
+    return dict([(module, known[module]) for module in modules])
+
+
+def _probe_imports(modules, script):
+    cmd = "python -c " + quote(__import_probe__) + " " + " ".join([quote(m) for m in modules])
+    if script is None:
+        status, out, err = mycmd(cmd)
+    else:
+        status, out, err = env_session(script).run(cmd)
+    if not isinstance(out, str):
+        out = out.decode('utf-8', 'replace')
+        err = err.decode('utf-8', 'replace')
+    try:
+        found = json.loads(out.strip().split('\n')[-1])
+        if type(found) is dict and len([m for m in modules if m in found]) == len(modules):
+            return dict([(str(m), found[m]) for m in modules])
+    except ValueError:
+        pass
+    if len(modules) == 1:
+        return {modules[0]: {'ok': False, 'error': "python exited with " + str(status) + ": " + err.strip()[-1000:]}}
+    found = {}
+    for module in modules:
+        found.update(_probe_imports([module], script))
+    return found
+
+
+def probe_components(components, kind="node"):
+    """
+    Probe the python modules which the skip rules of these components, and their children, import (their probes),
+    in one interpreter per environment script, so that each skip rule then finds its answer already there.
+    Components recorded as installed are left out, they do not need their skip rule, see Component.recorded.
+    Returns the modules probed by environment script.
+    """
+    wanted = {}
+    seen = set()
+
+    def _walk(component):
+        if id(component) in seen or not component.willinstall(kind):
+            return
+        seen.add(id(component))
+        if component.children is not None:
+            for child in component.children.get(linuxVersion, []):
+                _walk(child)
+        if len(component.probes) and component.toolbox is not None and component.recorded() is None:
+            wanted.setdefault(component.toolbox.envscript(), []).extend(component.probes)
+
+    for component in components:
+        _walk(component)
+    for script, modules in wanted.items():
+        probe_imports(modules, script)
+    return wanted
+
+
+def forget_imports():
+    """
+    Forget what probe_imports found, after something was installed
+    """
+    __probed_imports__.clear()
+
+
+def importcheck(cmd):
+    """
+    The modules a test command only imports, for commands like python -c "import a; import b;", None for others
+    """
+    match = re.match(r'^python -c "((?:\s*import [\w.]+;?)+)\s*"(?:\s*> */dev/null)?\s*$', cmd.strip())
+    if match is None:
+        return None
+    return [m.strip().split()[1].rstrip(';') for m in match.group(1).split(';') if len(m.strip())]
+
+
+#
+# Relocatable packs of installed trees
+#
+
+__pack_manifest__ = ".kave-pack.json"
+
+
+def _compiled(rel):
+    """
+    Is this compiled python? Marshalled code cannot be rewritten, only compiled again
+    """
+    return rel.endswith('.pyc') or rel.endswith('.pyo') or '__pycache__' in rel.split(os.sep)
+
+
+def _prefixed(directory, prefix, exclude):
+    """
+    Find the files and absolute links under directory which mention prefix, as (text, binary, links, compiled).
+    binary are ELF files, whose null-terminated strings can be rewritten in place. Compiled python mentioning
+    prefix is listed separately, and other files containing nulls are left alone.
+    """
+    text, binary, links, compiled = [], [], [], []
+    marker = prefix.encode('utf-8')
+    for root, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, directory)
+            if [e for e in exclude if fnmatch.fnmatch(rel, e)]:
+                continue
+            if os.path.islink(path):
+                if os.readlink(path).startswith(prefix):
+                    links.append(rel)
+                continue
+            if name in dirs or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as fp:
+                content = fp.read()
+            if marker not in content:
+                continue
+            if _compiled(rel):
+                compiled.append(rel)
+            elif content.startswith(b'\x7fELF'):
+                binary.append(rel)
+            elif b'\0' not in content:
+                text.append(rel)
+    return text, binary, links, compiled
+
+
+def packtree(directory, archive, exclude=[]):
+    """
+    Pack an installed tree into a relocatable .tar.gz archive, which relocate() adapts to wherever it is unpacked.
+    The files and links mentioning the directory itself are listed in a manifest packed with the tree, so that
+    unpacking does not need to search the whole tree again. Compiled python mentioning the directory is listed
+    apart, relocate() removes it for python to compile again.
+    exclude: relative paths (fnmatch patterns) to leave out, e.g. package caches
+    """
+    directory = os.path.realpath(directory)
+    text, binary, links, compiled = _prefixed(directory, directory, exclude)
+    with open(os.path.join(directory, __pack_manifest__), 'w') as fp:
+        json.dump({"prefix": directory, "text": text, "binary": binary, "links": links, "compiled": compiled}, fp)
+    partial = archive + '.' + str(os.getpid()) + '.tmp'
+    throw_on_fail_quiet("tar -czf " + quote(partial) + ' ' + ' '.join(["--exclude=" + quote('./' + e)
+                                                                       for e in exclude])
+                        + " -C " + quote(directory) + " .")
+    os.rename(partial, archive)
+    return archive
+
+
+def _binary_replace(content, old, new):
+    """
+    Replace old by new in the null-terminated strings of a binary, padding with nulls to keep every offset
+    """
+    pieces = content.split(old)
+    result = [pieces[0]]
+    for piece in pieces[1:]:
+        end = piece.find(b'\0')
+        if end < 0:
+            end = len(piece)
+        result.append(new + piece[:end] + b'\0' * (len(old) - len(new)) + piece[end:])
+    return b''.join(result)
+
+
+def relocate(directory):
+    """
+    Rewrite a tree unpacked from packtree() for the directory it now lives in.
+    Text files and links are rewritten freely, binaries only when the new path is not longer than the old one,
+    since the strings they contain cannot grow. Compiled python is removed, to be compiled again, also when
+    older packs listed it as binary. Returns the number of files and links rewritten or removed.
+    """
+    directory = os.path.realpath(directory)
+    manifest = os.path.join(directory, __pack_manifest__)
+    with open(manifest) as fp:
+        pack = json.load(fp)
+    if pack["prefix"] == directory:
+        return 0
+    old, new = pack["prefix"].encode('utf-8'), directory.encode('utf-8')
+    compiled = pack.get("compiled", []) + [rel for rel in pack["binary"] if _compiled(rel)]
+    for rel in compiled:
+        if os.path.exists(os.path.join(directory, rel)):
+            os.remove(os.path.join(directory, rel))
+    pack["binary"] = [rel for rel in pack["binary"] if not _compiled(rel)]
+    pack["compiled"] = []
+    if pack["binary"] and len(new) > len(old):
+        raise RuntimeError("Cannot relocate " + str(len(pack["binary"])) + " binaries from " + pack["prefix"]
+                           + " to the longer path " + directory)
+    for rel in pack["text"] + pack["binary"]:
+        path = os.path.join(directory, rel)
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        if rel in pack["text"]:
+            content = content.replace(old, new)
+        else:
+            content = _binary_replace(content, old, new)
+        mode = os.stat(path).st_mode
+        with open(path + '.relocating', 'wb') as fp:
+            fp.write(content)
+        os.chmod(path + '.relocating', mode)
+        os.rename(path + '.relocating', path)
+    for rel in pack["links"]:
+        path = os.path.join(directory, rel)
+        target = os.readlink(path)
+        os.remove(path)
+        os.symlink(directory + target[len(pack["prefix"]):], path)
+    pack["prefix"] = directory
+    with open(manifest, 'w') as fp:
+        json.dump(pack, fp)
+    return len(pack["text"]) + len(pack["binary"]) + len(pack["links"]) + len(compiled)
+
+
+#
+# State of the installed components
+#
+
+
+class InstallState(object):
+    """
+    What was installed on this host, kept in an sqlite database (path), so that skip decisions and
+    KaveInstall --status do not have to rediscover it every run.
+    For each component version: the recipe it was installed from (see Component.recipe), where from, when,
+    in how many seconds, the seconds per install phase, and the files of its versioned install directory.
+    readonly: only read an existing database, e.g. for KaveInstall --status as a user who cannot write it
+    """
+    schema = ["CREATE TABLE IF NOT EXISTS components (cname TEXT, version TEXT, kind TEXT, recipe TEXT, "
+              "source TEXT, directory TEXT, installed REAL, seconds REAL, phases TEXT, "
+              "PRIMARY KEY (cname, version))",
+              "CREATE TABLE IF NOT EXISTS files (cname TEXT, version TEXT, path TEXT, size INTEGER)",
+              "CREATE INDEX IF NOT EXISTS files_component ON files (cname, version)"]
+    columns = ["cname", "version", "kind", "recipe", "source", "directory", "installed", "seconds", "phases"]
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            if not os.path.isfile(path):
+                raise IOError("No database at " + path)
+            return
+        if not os.path.isdir(os.path.dirname(os.path.realpath(path))):
+            os.makedirs(os.path.dirname(os.path.realpath(path)))
+        with self._connect() as db:
+            for statement in self.schema:
+                db.execute(statement)
+
+    def _connect(self):
+        # a connection per use, so that forked installers never share one
+        if self.readonly:
+            try:
+                return contextlib.closing(sqlite3.connect('file:' + pathname2url(os.path.realpath(self.path))
+                                                          + '?mode=ro', timeout=60, uri=True))
+            except TypeError:
+                # python 2 cannot open read-only, the file exists so nothing is created
+                pass
+        return contextlib.closing(sqlite3.connect(self.path, timeout=60))
+
+    def lookup(self, cname, version):
+        """
+        The entry of this component version as a dict, None if it is not recorded
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT " + ", ".join(self.columns) + " FROM components WHERE cname = ? AND version = ?",
+                             (cname, str(version))).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(self.columns, row))
+        entry["phases"] = json.loads(entry["phases"] or "{}")
+        return entry
+
+    def record(self, component, seconds=None, phases=None, directory=None, files=None):
+        """
+        Record a component as installed now, replacing what was recorded for its version.
+        directory is its own versioned install directory, if it has one, files a list of
+        (path relative to that directory, size)
+        """
+        source = component.src_from
+        if type(source) is list:
+            source = source[0]
+        with self._connect() as db:
+            with db:
+                db.execute("INSERT OR REPLACE INTO components (" + ", ".join(self.columns) + ") "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (component.cname, str(component.version), getattr(component, "kind", None),
+                            component.recipe(), None if source is None else str(source), directory, time.time(),
+                            seconds, json.dumps(phases or {})))
+                db.execute("DELETE FROM files WHERE cname = ? AND version = ?",
+                           (component.cname, str(component.version)))
+                db.executemany("INSERT INTO files (cname, version, path, size) VALUES (?, ?, ?, ?)",
+                               [(component.cname, str(component.version), path, size) for path, size in files or []])
+
+    def files(self, cname, version):
+        with self._connect() as db:
+            return db.execute("SELECT path, size FROM files WHERE cname = ? AND version = ? ORDER BY path",
+                              (cname, str(version))).fetchall()
+
+    def entries(self):
+        """
+        Every recorded component version, most recently installed first, with the number and total size
+        of its files
+        """
+        with self._connect() as db:
+            rows = db.execute("SELECT " + ", ".join(["c." + c for c in self.columns]) + ", "
+                              "COUNT(f.path), SUM(f.size) FROM components c LEFT JOIN files f "
+                              "ON c.cname = f.cname AND c.version = f.version "
+                              "GROUP BY c.cname, c.version ORDER BY c.installed DESC").fetchall()
+        return [dict(zip(self.columns + ["nfiles", "size"], row)) for row in rows]
+
+    def status(self):
+        """
+        Print a table of the recorded components
+        """
+        print("%-20s %-14s %-11s %-20s %9s %9s %9s"
+              % ("Component", "Version", "Kind", "Installed", "Seconds", "Files", "MB"))
+        for e in self.entries():
+            print("%-20s %-14s %-11s %-20s %9s %9d %9.1f" % (
+                e["cname"][:20], e["version"][:14], (e["kind"] or "")[:11],
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["installed"])),
+                "%.1f" % e["seconds"] if e["seconds"] is not None else "found", e["nfiles"],
+                (e["size"] or 0) / 1024. ** 2))
+
+
+def treefiles(directory):
+    """
+    (path relative to directory, size) of every file below directory, not following links
+    """
+    found = []
+    for root, _dirs, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                found.append((os.path.relpath(path, directory), os.lstat(path).st_size))
+            except OSError:
+                continue
+    return found
+
+
+__install_state__ = []
+
+
+def install_state(readonly=False):
+    """
+    The InstallState at __state_db__, or None if it is disabled, or cannot be created or written.
+    readonly: only read the database, None if it does not exist or cannot be read
+    """
+    if __state_db__ is None or sqlite3 is None:
+        return None
+    if readonly:
+        try:
+            state = InstallState(__state_db__, readonly=True)
+            state.entries()
+        except (IOError, OSError, sqlite3.Error):
+            return None
+        return state
+    if not len(__install_state__) or __install_state__[0].path != __state_db__:
+        try:
+            state = InstallState(__state_db__)
+        except (IOError, OSError, sqlite3.Error):
+            return None
+        if not os.access(__state_db__, os.W_OK):
+            return None
+        __install_state__[:] = [state]
+    return __install_state__[0]
+
+
+#
+# Main installer class
+#
+
+
+class Component(object):
+    """
+    class wrapper for generic install scripts
+    cname, component name
+    installDir, where to install
+    install() can be overwritten with custom python
+    pre { OS: [] }, prerequisites to the true install, like installing component libraries
+    doInstall, install it or not
+    script(), simple script to run if possible, overwrite with custom python in derived classes
+    any other options variables used in the script, might be either { OS: {"OptName":optval} } or just {"option",
+    "value"}
+    node, install if on a node?
+    src_from, where to get the source from
+
+    """
+
+    def __init__(self, cname):
+        self.cname = cname
+        self.loud = True
+        self.pre = {}
+        self.prewithenv = {}
+        self.post = {}
         self.postwithenv = {}
         self.doInstall = True
         self.installSubDir = None
@@ -342,6 +2682,7 @@ class Component(object):
         self.skipIfDiskFull = False  # skip installation if disk is full
         self.cleanIfDiskFull = False  # skip installation if disk is full
         self.src_from = None
+        self.src_logical = None  # src_from as configured, before fillsrc looked it up
         self.node = True
         self.workstation = True
         self.workstationExtras = None
@@ -352,414 +2693,2061 @@ class Component(object):
         self.version = __version__
         self.freespace = 0  # /installdir size requirement in mb
         self.tempspace = 0  # /tmp size requirement in mb
+        self.downloadspace = 0  # size of the downloaded sources in mb, kept in the cache and prefetch directory
         self.usrspace = 0  # /usr size requirement in mb
         self.env = ""
         self.children = {}
+        # components to wait for when installing in parallel, if they are also being installed, and which
+        # invalidate the record of my installation when they are installed again
+        self.after = []
+        self.prerun = False  # pre commands already run, see PackageBatch
+        self.prebuilt = False  # set by script() when it unpacked a finished tree, which needs no post commands
         self.status = False
         self.tests = []  # associated tests
+        self.probes = []  # python modules which skipif imports, see probe_components
         # default to using all but one processor
         self.makeopts = ' -j ' + str(max(multiprocessing.cpu_count() - 1, 1))
 
-    def fillsrc(self):
+    def srcdict(self, src):
+        """
+        Complete a logical source, the arguments of fromKPMGrepo, with my version and name
+        """
+        # fill version with self.version if suffix is specified but not version
+        if 'version' not in src and 'suffix' in src:
+            src['version'] = self.version
+        if 'filename' not in src:
+            src['filename'] = self.cname
+        return src
+
+    def fillsrc(self):
+        """
+        Method to fill the src_from in case it must be logical
+        """
+        if self.src_from is None:
+            return False
+        if self.src_logical is None:
+            self.src_logical = json.loads(json.dumps(self.src_from))
+        if type(self.src_from) is list:
+            osf = [self.srcdict(s) if type(s) is dict else s for s in self.src_from]
+            self.src_from = [fromKPMGrepo(**s) if type(s) is dict else s for s in osf]
+        elif type(self.src_from) is dict:
+            self.src_from = fromKPMGrepo(**self.srcdict(self.src_from))
+        return True
+
+    def mirrorfiles(self):
+        """
+        The files a mirror needs to install me, worked out without looking anything up, as a list of
+        (repository path, [other sources of the same file])
+        """
+        sources = self.src_from
+        if type(sources) is not list:
+            sources = [sources]
+        paths, others = [], []
+        for src in sources:
+            if type(src) is dict:
+                paths.append(repopath(**self.srcdict(dict(src))))
+            elif src is not None and mirrorof(src) in [m if m.endswith('/') else m + '/'
+                                                       for m in __mirror_list__ + [__repo_url__]]:
+                paths.append(cachekey(src))
+            elif src is not None:
+                others.append(src)
+        if not paths:
+            return []
+        return [(paths[0], [__repo_url__.rstrip('/') + '/' + p for p in paths[1:]] + others)]
+
+    def copy(self, optional_froms, dest):
+        if type(optional_froms) is list:
+            for afrom in optional_froms:
+                if afrom is None:
+                    continue
+                try:
+                    return self.copy(afrom, dest)
+                except (RuntimeError, IOError):
+                    print("Failed to copy from", afrom, "retry next source")
+                    continue
+            raise RuntimeError("Failed to copy from any source " + str(optional_froms))
+        afrom = optional_froms
+        fetched = prefetched(afrom)
+        if fetched is not None:
+            linkorcopy(fetched, dest)
+            return True
+        cache = None
+        if isremote(afrom):
+            cache = artifact_cache()
+        if cache is not None and cache.get(afrom, dest):
+            print("Using cached copy of", afrom)
+            return True
+        start = time.time()
+        if isremote(afrom) and "drive.google" not in afrom:
+            if self.loud:
+                print("Downloading", afrom)
+            try:
+                download(afrom, dest)
+            except IOError as e:
+                raise RuntimeError(str(e))
+        else:
+            self.run(copymethods(afrom, dest))
+        if not os.path.exists(dest):
+            raise IOError("Cannot copy from " + afrom.__str__())
+        if isremote(afrom) and os.path.getsize(dest) > 1024 ** 2:
+            mirror_ranking().record(afrom, True, throughput=os.path.getsize(dest) / max(time.time() - start, 0.001))
+        if cache is not None:
+            cache.put(afrom, dest)
+        return True
+
+    def extract(self, optional_froms, directory, options="--no-same-owner"):
+        """
+        Fetch a tarball and unpack it into directory.
+        Small remote archives are piped into tar as they arrive, so they are decompressed and unpacked while
+        downloading and never need space in the tmpdir. The checksum is computed on the way, and the archive is
+        stored in the artifact cache if that is enabled, once it matches the manifest of its mirror.
+        Archives bigger than __stream_size__, or listed in a manifest, are downloaded into the tmpdir first, in
+        resumable chunks from all mirrors and checked against the manifest, then unpacked. Cached, prefetched and
+        local archives are unpacked in place.
+        """
+        if type(optional_froms) is list:
+            for afrom in optional_froms:
+                if afrom is None:
+                    continue
+                try:
+                    return self.extract(afrom, directory, options)
+                except RuntimeError:
+                    print("Failed to extract from", afrom, "retry next source")
+                    continue
+            raise RuntimeError("Failed to extract from any source " + str(optional_froms))
+        afrom = optional_froms
+        untar = "tar -x" + tarflags(afrom) + "f %s " + options + " -C " + directory
+        archive = prefetched(afrom)
+        cache = None
+        if isremote(afrom):
+            cache = artifact_cache()
+        if archive is None and cache is not None:
+            archive = cache.lookup(afrom)
+            if archive is not None:
+                print("Using cached copy of", afrom)
+        if archive is None and os.path.isfile(afrom):
+            archive = afrom
+        if archive is not None:
+            self.run(untar % archive)
+            return True
+        if (not isremote(afrom) or "drive.google" in afrom or manifest_entry(afrom) is not None
+                or discovered(afrom) or remotesize(afrom) > __stream_size__):
+            # nothing to stream from, listed in a manifest, so checked against it before any of it is unpacked,
+            # or too big to start over: copy to the tmpdir first
+            archive = os.path.join(self.tmpdir or '.', os.path.basename(afrom.split('?')[0]))
+            self.copy(afrom, archive)
+            try:
+                self.run(untar % archive)
+            finally:
+                os.remove(archive)
+            return True
+        if self.loud:
+            print("Downloading and extracting", afrom)
+        start = time.time()
+        keep = None
+        if cache is not None:
+            # not the partial download of the same source, that one is for resuming fetch()
+            keep = _CacheCopy(cache.partial(afrom) + '.extract.' + str(os.getpid()))
+        __stats__["subprocesses"] += 1
+        proc = sub.Popen((untar % '-').split(), stdin=sub.PIPE)
+        error = None
+        try:
+            nbytes, checksum = http_transport().pipe(afrom, [proc.stdin] + [k for k in [keep] if k is not None])
+        except IOError as e:
+            error = str(e)
+        finally:
+            proc.stdin.close()
+            if keep is not None:
+                keep.close()
+        if proc.wait() != 0 and error is None:
+            error = "tar failed to extract the archive, exit code " + str(proc.returncode)
+        if error is not None:
+            if keep is not None:
+                keep.drop()
+            raise RuntimeError("Problem extracting " + afrom + ": " + error)
+        expected = manifest_entry(afrom)
+        if expected is not None and (nbytes != expected['size'] or checksum != expected['sha256']):
+            if keep is not None:
+                keep.drop()
+            raise RuntimeError("Download of " + afrom + " does not match the manifest")
+        if nbytes > 1024 ** 2:
+            mirror_ranking().record(afrom, True, throughput=nbytes / max(time.time() - start, 0.001))
+        if keep is not None and not keep.failed:
+            try:
+                cache.put(afrom, keep.path, checksum=checksum)
+            except (IOError, OSError) as e:
+                print("Could not cache", afrom, ",", e)
+            keep.drop()
+        return True
+
+    def summary(self):
+        print(self.cname, " Summary :")
+        print("    Installing?", self.doInstall)
+        print("    To:", self.topdir, self.installSubDir, "i.e.:", self.todir())
+        print("    Version:", self.version)
+        print("    From:", self.src_from)
+        print("    Nodes?:", self.node)
+        print("    Workstations?:", self.workstation)
+        print("    Workstations Extras:", self.workstationExtras)
+        print("    Pre:", self.pre)
+        print("    Pre with environment file:", self.prewithenv)
+        print("    Post:", self.post)
+        print("    Post with environment file:", self.postwithenv)
+        print("    Options:", self.options)
+        print("----------------------------")
+
+    def script(self):
+        """
+        Script method, if self.src_from is set then download it from the repo
+        execute downloaded shell scripts or python files, that is all
+        Complicated installs will overwrite this class.
+        """
+        if self.src_from is None:
+            return False
+        afrom = self.src_from
+        if type(afrom) is list:
+            try:
+                afrom = [a for a in afrom if a is not None][0]
+            except IndexError:
+                return False
+        # default, get file, if it is a .sh file, run it
+        ext = ""
+        try:
+            f = afrom.split("/")[-1].split('\\')[-1].split("?")[0]
+            if '.' in f:
+                ext = '.'.join(f.split(".")[1:])
+        except AttributeError:
+            print("warning, could not determine file extension, does the download location exist?")
+        if ext.endswith(".tar.gz") or ext.endswith(".tar"):
+            return self.extract(self.src_from, ".", options="")
+        dest = self.cname + '.' + ext
+        self.copy(self.src_from, dest)
+        if ext.endswith(".sh"):
+            os.system("chmod a+x " + dest)
+            self.run("./" + dest)
+        elif ext.endswith(".py"):
+            self.run("python ./" + dest)
+        elif ext.endswith(".rpm"):
+            self.run("rpm -i ./" + dest)
+        return True
+
+    def todir(self):
+        """
+        It's often complex to interpret exactly where a component will be installed,
+        this method does just that and caches the result.
+        """
+        if self.installDir is not None:
+            return self.installDir
+        if self.installSubDir is not None and self.topdir is not None:
+            return (self.topdir + os.sep + self.installSubDir).replace("//", "/")
+        if self.topdir is not None:
+            return self.topdir
+        if self.topdir is None and self.installSubDir is not None:
+            return (InstallTopDir + os.sep + self.installSubDir).replace("//", "/")
+        if self.topdir is None:
+            return InstallTopDir
+        return None
+
+    def checkadisk(self, disk, space):
+        """
+        Check that so much space is available on a disk containing a given directory
+        """
+        _device, mount, free, inodes = diskfree(disk)
+        if inodes < 100:
+            raise OSError("No free inodes on mount point " + mount + " to install " + self.cname)
+        if free < space:
+            raise OSError("Not enough space on mount point " + mount + " to install " + self.cname
+                          + " (" + disk + "). Skip the installation, cleanup, or add more disk space, an additional "
+                          + str(space - free) + " MB is needed")
+        return mount
+
+    def clean(self, others_only=False):
+        if self.installDir is not None and os.path.exists(self.installDir):
+            if not others_only:
+                print("Force-cleaning installation directory as requested")
+                if len(self.installDirPro) > 4 and os.path.islink(self.installDirPro):
+                    self.run("rm -f " + self.installDirPro)
+                if len(self.installDirPro) > 4 and os.path.exists(self.installDirPro):
+                    self.run("rm -rf " + self.installDirPro)
+                if len(self.installDirVersion) > 4 and os.path.exists(self.installDirVersion):
+                    self.run("rm -rf " + self.installDirVersion)
+                if (len(self.installDir) > 4 and (os.path.exists(self.installDir)
+                                                  and (os.path.realpath(self.installDir)
+                                                       != os.path.realpath(self.topdir)))):
+                    self.run("rm -rf " + self.installDir)
+            else:
+                print("Force-cleaning obsolete installations as requested")
+                import glob
+                dirs = glob.glob(self.installDir + '/*')
+                cleaning = [os.path.realpath(d) for d in dirs if os.path.realpath(d)
+                            not in [os.path.realpath(self.installDir),
+                                    os.path.realpath(self.installDirVersion),
+                                    os.path.realpath(self.installDirPro)]]
+                cleaning = [d for d in cleaning if len(d) > 4 and os.path.isdir(d)]
+                [self.run("rm -rf " + d) for d in cleaning if os.path.isdir(d)]
+            return True
+        return False
+
+    def __checkdloop(self, mounts):
+        """
+        Loop to check for disk space, expect OSError if not enough space
+        """
+        checked_mounts = {}
+        for k, v in mounts.items():
+            mnt = self.checkadisk(k, v)
+            try:
+                checked_mounts[mnt] = checked_mounts[mnt] + v
+            except KeyError:
+                checked_mounts[mnt] = v
+        if len(checked_mounts) < len(mounts):
+            [self.checkadisk(k, v) for k, v in checked_mounts.items()]
+        return checked_mounts
+
+    def diskneeds(self):
+        """
+        The space this component needs to install, as {directory: MB}
+        """
+        mounts = {}
+        if self.freespace:
+            if self.installDir:
+                mounts[self.installDir] = self.freespace
+            else:
+                mounts['/'] = self.freespace
+        if self.tempspace:
+            if self.tmpdir:
+                mounts[self.tmpdir] = self.tempspace
+            else:
+                mounts['/tmp'] = self.tempspace
+        if self.usrspace:
+            mounts['/usr'] = mounts.get('/usr', 0) + self.usrspace
+        return mounts
+
+    def constinstdir(self):
+        """
+        Construct the installation directory
+        """
+        if self.installDir is None:
+            self.installDir = self.todir()
+            self.installDirVersion = (self.installDir + os.sep + self.version).replace("//", "/")
+            self.installDirPro = (self.installDir + os.sep + 'pro').replace("//", "/")
+
+    def skipif(self):
+        """
+        Rules which cause the skipping of installation of a package
+        by default, False
+        """
+        return False
+
+    def willinstall(self, kind="node"):
+        """
+        Would install() go beyond the doInstall and node/workstation checks for this kind of install?
+        """
+        if not self.doInstall:
+            return False
+        if kind == "node" and not self.node:
+            return False
+        if kind == "workstation" and not self.workstation:
+            return False
+        return True
+
+    def willskip(self):
+        """
+        Would install() skip this component once past willinstall, before running anything: this version is
+        already in its directory, a 1.X-KTB version is there, it was recorded as installed, or skipif says so
+        """
+        if self.topdir is None:
+            self.topdir = InstallTopDir
+        self.constinstdir()
+        if (self.installDir is not None and os.path.exists(self.installDir) and self.installDir != self.topdir
+                and not self.cleanBefore):
+            if os.path.isdir(self.installDirVersion):
+                return True
+            if (not os.path.exists(self.installDirPro) and not os.path.islink(self.installDirPro)
+                    and len(os.listdir(self.installDir))):
+                return True
+        if self.hasskiprule() and self.recorded() is not None:
+            return True
+        return bool(self.skipif())
+
+    def install(self, kind="node", tmpdir=None, loud=True):
+        """
+        Used by the installer, eventually calls the script method
+        It is not usual for component derived classes to override this method,
+        since they override the pre, post and script() classes instead
+        """
+        self.odir = os.path.realpath(os.curdir)
+        start = time.time()
+        self.kind = kind
+        if self.topdir is None:
+            self.topdir = InstallTopDir
+        self.tmpdir = tmpdir
+        self.loud = loud
+        self.constinstdir()
+        if not self.doInstall:
+            return False
+        if self.kind is "node" and not self.node:
+            return False
+        if self.kind is "workstation" and not self.workstation:
+            return False
+        if self.installDir is not None and os.path.exists(self.installDir) and (self.installDir != self.topdir):
+            if self.cleanBefore:
+                self.clean()
+            if os.path.isdir(self.installDirVersion):
+                print("Skipping", self.cname, "because this version is already installed")
+                print("remove", self.installDirVersion, "if you want to force re-install")
+                if self.recorded() is None:
+                    self.record()
+                self.buildenv()
+                return self.__install_end_actions()
+                # Detect previous KTB installation and skip
+            if (os.path.exists(self.installDir) and not os.path.exists(self.installDirPro)
+                    and not os.path.islink(self.installDirPro) and len(os.listdir(self.installDir))):
+                print("Skipping", self.cname, "because a 1.X-KTB version was already installed")
+                print("remove", self.installDir, "if you want to force re-install")
+                return False
+        # additional user-defined skipping, not needed again once this was recorded as installed
+        recorded = None
+        if self.hasskiprule():
+            recorded = self.recorded()
+        if recorded is not None:
+            print("Skipping", self.cname, "because this version was installed on",
+                  time.strftime("%Y-%m-%d %H:%M", time.localtime(recorded["installed"])))
+            print("run with --no-state if you want to check again")
+            self.buildenv()
+            return self.__install_end_actions()
+        with phase(self.cname, "skipif"):
+            skip = self.skipif()
+        if skip:
+            print("Skipping", self.cname, "because a custom skip rule asked to, e.g. already installed")
+            if self.hasskiprule():
+                self.record()
+            self.buildenv()
+            return self.__install_end_actions()
+        ##############################
+        # Check disk space
+        ##############################
+        mounts = self.diskneeds()
+        with phase(self.cname, "diskcheck"):
+            # Check these mountpoints and clean if requested
+            try:
+                self.__checkdloop(mounts)
+            except OSError as e:
+                if self.cleanIfDiskFull:
+                    self.clean()
+                # Check again and skip if requested
+                try:
+                    self.__checkdloop(mounts)
+                except OSError as e:
+                    if self.skipIfDiskFull:
+                        print("Skipping", self.cname, "because of insufficient disk space")
+                        print(e)
+                        return self.buildenv()
+                    raise e
+        ##############################
+        # Install children
+        ##############################
+        if self.children is not None and linuxVersion in self.children:
+            with phase(self.cname, "children"):
+                children = time.time()
+                for child in self.children[linuxVersion]:
+                    child.register_toolbox(self.toolbox)
+                    if not child.status:
+                        child.install(kind=self.kind, tmpdir=self.tmpdir, loud=self.loud)
+                start += time.time() - children
+        ##############################
+        # run prerequisites
+        ##############################
+        print("Installing", self.cname)
+        if self.pre is not None and linuxVersion in self.pre and not self.prerun:
+            with phase(self.cname, "pre"):
+                for cmd in self.pre[linuxVersion]:
+                    self.run(cmd)
+        # run prerequisites that require the environment
+        if self.prewithenv is not None and linuxVersion in self.prewithenv:
+            with phase(self.cname, "prewithenv"):
+                self._allwithenv(self.prewithenv[linuxVersion])
+        # run workstation extras
+        if (self.kind is "workstation" and (self.workstationExtras is not None
+                                            and linuxVersion in self.workstationExtras)):
+            with phase(self.cname, "workstationExtras"):
+                for cmd in self.workstationExtras[linuxVersion]:
+                    self.run(cmd)
+        if self.installDir is not None and self.installDirVersion.count('/') > 1:
+            self.run("mkdir -p " + os.sep.join(self.installDirVersion.split(os.sep)[:-1]))
+        # Find the places to download from
+        with phase(self.cname, "fillsrc"):
+            self.fillsrc()
+        # run script :)
+        with phase(self.cname, "script"):
+            self.script()
+        # run post actions
+        if self.post is not None and linuxVersion in self.post and not self.prebuilt:
+            with phase(self.cname, "post"):
+                for cmd in self.post[linuxVersion]:
+                    self.run(cmd)
+        with phase(self.cname, "buildenv"):
+            self.buildenv()
+        # run post actions that require the environment
+        if self.postwithenv is not None and linuxVersion in self.postwithenv and not self.prebuilt:
+            with phase(self.cname, "postwithenv"):
+                self._allwithenv(self.postwithenv[linuxVersion])
+        os.chdir(self.odir)
+        if self.installDir is not None and self.installDir.count('/') > 1 and os.path.exists(self.installDir):
+            with phase(self.cname, "chmod"):
+                self.run("chmod -R a+rx " + self.installDir)
+        install_timings().record(self, time.time() - start)
+        self.record(time.time() - start)
+        forget_imports()
+        return self.__install_end_actions()
+
+    def __install_end_actions(self):
+        self.status = True
+        # create pro softlink
+        if self.installDir is not None:
+            if ((os.path.exists(self.installDirPro) or os.path.islink(self.installDirPro))
+                    and os.path.exists(self.installDirVersion)):
+                os.system("rm " + self.installDirPro)
+            if os.path.exists(self.installDirVersion):
+                os.system("ln -s " + self.installDirVersion + " " + self.installDirPro)
+
+        # clean the temporary directory of files I created
+        if self.tmpdir is not None:
+            if os.path.exists(self.tmpdir) and len(self.tmpdir) > 4:
+                os.system("rm -rf " + self.tmpdir + '/*')
+        if self.installDir is not None and os.path.exists(self.installDir) and (self.installDir != self.topdir):
+            if self.cleanAfter:
+                self.clean(others_only=True)
+        return True
+
+    def recipe(self):
+        """
+        sha256 of what decides what this component installs: its version, where to, the files it is installed from
+        and its options and commands for this OS
+        """
+        commands = [getattr(self, a).get(linuxVersion) if getattr(self, a) is not None else None
+                    for a in ["pre", "prewithenv", "post", "postwithenv"]]
+        source = self.src_from
+        if self.src_logical is not None:
+            source = self.src_logical
+        recipe = [str(self.version), self.installSubDir, source, self.options, commands]
+        return hashlib.sha256(json.dumps(recipe, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def hasskiprule(self):
+        """
+        Does this component have its own skipif, which a record of its installation can stand in for?
+        """
+        mine = type(self).skipif
+        return getattr(mine, '__func__', mine) is not getattr(Component.skipif, '__func__', Component.skipif)
+
+    def recorded(self):
+        """
+        The InstallState entry saying this version was installed from the same recipe, None if there is none,
+        its install directory is gone, or a component it was installed into (after) was not recorded or was
+        recorded again since, e.g. conda reinstalled under packages installed with it
+        """
+        state = install_state()
+        if state is None:
+            return None
+        entry = state.lookup(self.cname, self.version)
+        if entry is None or self.recipe() != entry["recipe"]:
+            return None
+        if entry["directory"] is not None and not os.path.isdir(entry["directory"]):
+            return None
+        for other in self.after:
+            was = state.lookup(other.cname, other.version)
+            if was is None or was["installed"] > entry["installed"]:
+                return None
+        return entry
+
+    def record(self, seconds=None):
+        """
+        Record this component as installed in the InstallState, seconds is None if it was found installed
+        """
+        state = install_state()
+        if state is None:
+            return
+        directory = None
+        files = []
+        if (self.installDir is not None and self.installDir != self.topdir
+                and os.path.isdir(self.installDirVersion)):
+            directory = self.installDirVersion
+            files = treefiles(directory)
+        try:
+            state.record(self, seconds, __phase_seconds__.get(self.cname), directory, files)
+        except sqlite3.Error as e:
+            print("Could not record", self.cname, "in", state.path, ":", e)
+
+    def register_toolbox(self, toolbox):
+        """
+        The method of finding the env script must be known by components, and so the Component which installs
+        KaveToolbox itself needs to be remembered and resolved at runtime
+        """
+        self.toolbox = toolbox
+
+    def knownreplaces(self, stringtosearch):
+        self.constinstdir()
+        e = stringtosearch.replace("%%INSTALLDIR%%", self.installDir)
+        e = e.replace("%%INSTALLDIRPRO%%", self.installDirPro)
+        e = e.replace("%%INSTALLDIRVERSION%%", self.installDirVersion)
+        e = e.replace("%%VERSION%%", self.version)
+        return e
+
+    def buildenv(self):
+        """
+        Build env adds to the standard environment script the contents of self.env
+        in order to build a static env file (fastest approach) this method can autoreplace the key
+        to determine the installed package directory
+        self.env.replace("%%INSTALLDIR%%", self.todir())
+        """
+        if self.toolbox is None:
+            return
+        if not len(self.env):
+            return
+        loc = self.toolbox.envscript().split()[0]
+        if not len(loc):
+            return
+        env_file(loc).set(self.cname, '#\n' + self.knownreplaces(self.env) + '#\n')
+        return True
+
+    def run(self, cmd):
+        """
+        Intelligently run a command, either cleaning or exiting if the command fails
+        Package manager commands are serialised when installing in parallel
+        """
+        with locked(command_lock(cmd)):
+            if self.tmpdir is not None and os.path.exists(self.tmpdir):
+                return self._clean_on_fail(cmd, self.tmpdir)
+            self._throw_on_fail(cmd)
+
+    def withenv(self, cmd, loud=False):
+        """
+        Run a command after sourcing the environment script, in a session kept open between commands.
+        Returns (status, stdout, stderr) like mycmd, printing the output instead if loud, otherwise keeping
+        the full output in my logfile
+        """
+        with locked(command_lock(cmd)):
+            return env_session(self.toolbox.envscript()).run(cmd, loud=loud, log=self.logfile())
+
+    def imports(self, *modules):
+        """
+        What importing these python modules finds in the environment, see probe_imports
+        """
+        return probe_imports(list(modules), self.toolbox.envscript())
+
+    def runwithenv(self, cmd):
+        """
+        Like run, after sourcing the environment script, see withenv.
+        Raises a RuntimeError if the command fails, removing the temporary directory if there is one
+        """
+        status, output, err = self.withenv(cmd, loud=self.loud)
+        if status:
+            if self.tmpdir is not None and os.path.exists(self.tmpdir) and len(self.tmpdir) > 4:
+                os.system("rm -rf " + self.tmpdir)
+            log = None
+            if not self.loud:
+                log = self.logfile()
+            raise RuntimeError("Problem running: \n" + cmd + "\n got:\n\t" + str(status)
+                               + "\n from: \n" + str(output) + " stderr: \n" + str(err) + _full_output(log))
+        return output.strip()
+
+    def pipinstall(self, requirements, prefix="", check=True):
+        """
+        pip install the requirements, a list of pip install arguments, in the environment, through the wheelhouse
+        if the cache is enabled, see Wheelhouse.
+        prefix: shell commands to run before pip, e.g. exports
+        check: raise a RuntimeError if the install fails, otherwise return its status. Requirements failing
+        together are then installed one at a time, so that one which fails does not keep out the others.
+        """
+        status = self._pipinstall(requirements, prefix, check)
+        if check or not status:
+            return status
+        # each requirement on its own, a -r keeps its file
+        separate = []
+        for requirement in requirements:
+            if len(separate) and separate[-1] == ["-r"]:
+                separate[-1].append(requirement)
+            else:
+                separate.append([requirement])
+        if len(separate) < 2:
+            return status
+        failed = [r for r in separate if self._pipinstall(r, prefix, check)]
+        if failed:
+            print("Could not pip install", ' '.join([' '.join(r) for r in failed]))
+            return status
+        return 0
+
+    def _pipinstall(self, requirements, prefix, check):
+        house = wheelhouse()
+        if house is not None:
+            return house.install(self, requirements, prefix=prefix, check=check)
+        cmd = prefix + "pip install " + ' '.join([quote(r) for r in requirements])
+        if check:
+            self.runwithenv(cmd)
+            return 0
+        return self.withenv(cmd, loud=self.loud)[0]
+
+    def _allwithenv(self, cmds):
+        """
+        Run commands in the environment, consecutive plain pip installs together in one pipinstall
+        """
+        requirements = []
+        for cmd in cmds + [None]:
+            args = None
+            if cmd is not None:
+                args = pipinstall(cmd)
+            if args is not None:
+                requirements = requirements + args
+                continue
+            if requirements:
+                self.pipinstall(requirements)
+                requirements = []
+            if cmd is not None:
+                self.runwithenv(cmd)
+
+    def bauk(self, reason):
+        """
+        Exit and raise runtime error after cleaning my temporary directory
+        """
+        if self.tmpdir is not None:
+            if os.path.exists(self.tmpdir) and len(self.tmpdir) > 4:
+                os.system("rm -rf " + self.tmpdir)
+        raise RuntimeError(reason)
+
+    def logfile(self):
+        """
+        The file keeping the full output of my quiet commands, None if __log_dir__ is not set
+        """
+        if __log_dir__ is None:
+            return None
+        if not os.path.isdir(__log_dir__):
+            try:
+                os.makedirs(__log_dir__)
+            except OSError:
+                # made meanwhile by a parallel install
+                pass
+        return os.path.join(__log_dir__, self.cname + '.log')
+
+    def _throw_on_fail(self, cmd):
+        if self.loud:
+            return throw_on_fail_loud(cmd)
+        throw_on_fail_quiet(cmd, log=self.logfile())
+
+    def _clean_on_fail(self, cmd, dir):
+        if self.loud:
+            return clean_on_fail_loud(cmd, dir)
+        clean_on_fail_quiet(cmd, dir, log=self.logfile())
+
+
+#
+# Disk space planning
+#
+
+
+class DiskPlan(object):
+    """
+    Check up front that all components to install fit on disk together, before anything is installed.
+    The freespace and usrspace of all components are added up per filesystem, so that several components
+    installing to the same disk are checked against its free space together, not one by one.
+    The tempspace is only needed while a component installs, its tmpdir is wiped afterwards, so only the largest
+    one counts, or the sum of the largest workers ones when that many components install in parallel.
+    On top come the downloads kept by the artifact cache, up to its budget, and in the prefetch directory.
+    Versions which are already installed need no space.
+
+    usage: DiskPlan(components, kind, tmpdir, workers=1, prefetch=False).check()
+    """
+
+    def __init__(self, components, kind="node", tmpdir=None, workers=1, prefetch=False):
+        self.needs = {}  # device: MB needed at the peak of the installation
+        self.mounts = {}  # device: (mount point, free MB, free inodes)
+        self.users = {}  # device: [(component, MB)] kept after the component is installed
+        self.temps = {}  # device: [(component, MB)] only needed while the component installs
+        self.extras = {}  # device: (MB, what for) needed by the downloads themselves
+        self.workers = max(int(workers), 1)
+        self.components = []
+        for component in InstallScheduler(components, kind=kind).components:
+            if not component.willinstall(kind) or component.status:
+                continue
+            if component.topdir is None:
+                component.topdir = InstallTopDir
+            component.constinstdir()
+            if (component.installDir is not None and component.installDir != component.topdir
+                    and os.path.isdir(component.installDirVersion)):
+                continue
+            component.tmpdir = tmpdir
+            self.components.append(component)
+            for directory, space in component.diskneeds().items():
+                device = self._device(directory)
+                if directory == (tmpdir or '/tmp'):
+                    self.temps[device] = self.temps.get(device, []) + [(component, space)]
+                else:
+                    self.users[device] = self.users.get(device, []) + [(component, space)]
+        downloads = [c.downloadspace for c in self.components]
+        if prefetch:
+            planned = set([id(c) for c in self.components])
+            fetched = [c.downloadspace for c in Prefetcher.selected(self.components, kind) if id(c) in planned]
+            if sum(fetched):
+                self._extra(self._device(tmpdir or '/tmp'), sum(fetched), "prefetch")
+        cache = artifact_cache()
+        if cache is not None and sum(downloads):
+            # the cache grows up to its budget, and goes over it by one download until that is evicted again
+            headroom = max(cache.budget - cache.size(), 0) // 1024 ** 2
+            self._extra(self._device(cache.directory), min(sum(downloads), headroom) + max(downloads), "cache")
+        for device in set(list(self.users) + list(self.temps) + list(self.extras)):
+            self.needs[device] = (sum([s for _c, s in self.users.get(device, [])])
+                                  + self.peak([s for _c, s in self.temps.get(device, [])])
+                                  + self.extras.get(device, (0, ""))[0])
+
+    def _device(self, directory):
+        device, mount, free, inodes = diskfree(directory)
+        self.mounts[device] = (mount, free, inodes)
+        return device
+
+    def _extra(self, device, space, what):
+        space = self.extras.get(device, (0, ""))[0] + space
+        self.extras[device] = (space, " and ".join([w for w in [self.extras.get(device, (0, ""))[1], what] if w]))
+
+    def peak(self, spaces):
         """
-        Method to fill the src_from in case it must be logical
+        The most temporary space needed at once, by the workers largest of spaces in MB
         """
-        if self.src_from is None:
-            return False
-        if type(self.src_from) is list:
-            # fill version with self.version if suffix is specified but not version
-            osf = []
-            for s in self.src_from:
-                if type(s) is dict and 'version' not in s and 'suffix' in s:
-                    s['version'] = self.version
-                if type(s) is dict and 'filename' not in s:
-                    s['filename'] = self.cname
-                osf.append(s)
-            self.src_from = [fromKPMGrepo(**s) if type(s) is dict else s for s in osf]
-        elif type(self.src_from) is dict:
-            if 'version' not in self.src_from and 'suffix' in self.src_from:
-                self.src_from['version'] = self.version
-            if 'filename' not in self.src_from:
-                self.src_from['filename'] = self.cname
-            self.src_from = fromKPMGrepo(**self.src_from)
-        return True
+        return sum(sorted(spaces, reverse=True)[:self.workers])
 
-    def copy(self, optional_froms, dest):
-        if type(optional_froms) is list:
-            for afrom in optional_froms:
-                if afrom is None:
-                    continue
-                try:
-                    return self.copy(afrom, dest)
-                except RuntimeError as IOError:
-                    print("Failed to copy from", afrom, "retry next source")
+    def short(self):
+        """
+        {device: message} for every filesystem without enough free space or inodes
+        """
+        problems = {}
+        for device, need in self.needs.items():
+            mount, free, inodes = self.mounts[device]
+            if inodes < 100:
+                problems[device] = "No free inodes on mount point " + mount
+            elif free < need:
+                names = [c.cname for c, _s in self.users.get(device, []) + self.temps.get(device, [])]
+                if device in self.extras:
+                    names.append(self.extras[device][1])
+                problems[device] = ("Not enough space on mount point " + mount + ", " + str(need) + " MB needed by "
+                                    + ", ".join(sorted(set(names), key=names.index)) + " but only "
+                                    + str(free) + " MB free")
+        return problems
+
+    def check(self):
+        """
+        Raise an OSError listing all full filesystems, before anything is installed.
+        If all components on the full filesystems may skip or clean when the disk is full, they are left to do so
+        instead: components which fit are kept, in install order, and the others are switched off if they skip,
+        or clean when installed. Returns the list of components switched off.
+        """
+        problems = self.short()
+        if not problems:
+            return []
+        involved = [c for device in problems for c, _s in self.users.get(device, []) + self.temps.get(device, [])]
+        if len([c for c in involved if not (c.skipIfDiskFull or c.cleanIfDiskFull)]):
+            raise OSError("Insufficient disk space to install, nothing was installed. Skip some installations, "
+                          "cleanup, or add more disk space:\n\t" + "\n\t".join(problems.values()))
+        skipped = []
+        left = dict([(device, mount[1] - self.extras.get(device, (0, ""))[0])
+                     for device, mount in self.mounts.items()])
+        kept = {}  # device: [MB] tempspace of the components kept
+        for component in self.components:
+            uses = [(device, space) for device in self.users for c, space in self.users[device] if c is component]
+            temps = [(device, space) for device in self.temps for c, space in self.temps[device] if c is component]
+            after = dict(left)
+            for device, space in uses:
+                after[device] = after[device] - space
+            if len([device for device, _s in uses + temps
+                    if after[device] < self.peak(kept.get(device, []) + [s for d, s in temps if d == device])
+                    or device in problems and self.mounts[device][2] < 100]):
+                if not component.cleanIfDiskFull:
+                    print("Skipping", component.cname, "because of insufficient disk space")
+                    component.doInstall = False
+                    skipped.append(component)
+                continue
+            left = after
+            for device, space in temps:
+                kept[device] = kept.get(device, []) + [space]
+        return skipped
+
+
+class InstallPlan(object):
+    """
+    What an install would do, without doing it: the components in install order, whether they would be
+    installed or skipped and why, the size of what they would download (from the Content-Length of each source,
+    or zero if cached), and how long they took to install on this host before.
+    Does run the skip rules and look up the sources, which may start read-only commands and web requests.
+
+    usage: InstallPlan(components, kind, tmpdir, workers=1, prefetch=False).show()
+    """
+
+    def __init__(self, components, kind="node", tmpdir=None, workers=1, prefetch=False):
+        self.kind = kind
+        self.disk = DiskPlan(components, kind, tmpdir, workers, prefetch)
+        self.steps = []  # (component, action, [(source, bytes or None)], seconds or None)
+        for component in InstallScheduler(components, kind=kind).components:
+            if not component.willinstall(kind):
+                continue
+            if component.status:
+                action = "skip, already done"
+            elif component not in self.disk.components:
+                action = "skip, version installed"
+            elif component.skipif():
+                action = "skip, custom rule"
+            else:
+                action = "install"
+            downloads = []
+            if action == "install":
+                component.fillsrc()
+                downloads = self.downloads(component.src_from)
+            self.steps.append((component, action, downloads, install_timings().estimate(component)))
+
+    @staticmethod
+    def downloads(sources):
+        """
+        [(source, bytes)] for the first available source, bytes None if unknown, 0 if cached or local
+        """
+        if type(sources) is not list:
+            sources = [sources]
+        for source in [s for s in sources if s is not None]:
+            if not isremote(source):
+                if os.path.exists(source):
+                    return [(source, 0)]
+                continue
+            if prefetched(source) is not None or (artifact_cache() is not None
+                                                  and artifact_cache().lookup(source) is not None):
+                return [(source, 0)]
+            if "drive.google" in source:
+                return [(source, None)]
+            try:
+                status, headers, _elapsed = http_transport().head(source)
+            except IOError:
+                continue
+            if status == 200:
+                size = headers.get('content-length')
+                return [(source, int(size) if size is not None else None)]
+        return [(s, None) for s in sources[:1] if s is not None]
+
+    def show(self):
+        """
+        Print the plan, returns False if it would not fit on disk
+        """
+        print("%-24s %-24s %10s %10s  %s" % ("Component", "Action", "MB", "Minutes", "Source"))
+        total_bytes = 0
+        total_seconds = 0
+        unknown = []
+        for component, action, downloads, seconds in self.steps:
+            size = sum([b for _s, b in downloads if b is not None])
+            total_bytes += size
+            if action == "install":
+                if seconds is None:
+                    unknown.append(component.cname)
+                else:
+                    total_seconds += seconds
+            print("%-24s %-24s %10s %10s  %s" % (
+                component.cname[:24], action,
+                "%.1f" % (size / 1024. ** 2) if len(downloads) and None not in [b for _s, b in downloads] else "?",
+                "%.1f" % (seconds / 60.) if seconds is not None and action == "install" else "-",
+                " ".join([s for s, _b in downloads])))
+        print("Total download: %.1f MB" % (total_bytes / 1024. ** 2))
+        print("Estimated duration: %.1f minutes" % (total_seconds / 60.)
+              + (", plus " + ", ".join(unknown) + " never installed on this host" if unknown else ""))
+        problems = self.disk.short()
+        for device, need in sorted(self.disk.needs.items(), key=lambda n: self.disk.mounts[n[0]][0]):
+            mount, free, _inodes = self.disk.mounts[device]
+            print("Disk %s: %d MB needed, %d MB free%s" % (mount, need, free,
+                                                           ", NOT ENOUGH" if device in problems else ""))
+        return not len(problems)
+
+
+#
+# Batched package installation
+#
+
+# plain package installs which can be merged, command prefix: merged command
+__package_installs__ = {("yum", "-y", "install"): "yum -y install",
+                        ("yum", "install", "-y"): "yum -y install",
+                        ("yum", "-y", "groupinstall"): "yum -y groupinstall",
+                        ("apt-get", "-y", "install"): "apt-get -y install",
+                        ("apt-get", "install", "-y"): "apt-get -y install"}
+
+
+def packageinstall(cmd):
+    """
+    Split a plain package install command into (merged command, [packages]), or return None for anything else,
+    such as commands with extra options, several commands or shell constructs
+    """
+    if len([c for c in ";|&<>$`()\n" if c in cmd]):
+        return None
+    try:
+        args = shlex.split(cmd)
+    except ValueError:
+        return None
+    if tuple(args[:3]) not in __package_installs__ or len(args) < 4:
+        return None
+    if len([a for a in args[3:] if a.startswith("-")]):
+        return None
+    return __package_installs__[tuple(args[:3])], args[3:]
+
+
+class PackageBatch(object):
+    """
+    Run the pre commands of all the components to install up front, merging plain package installs
+    (yum -y install, yum -y groupinstall, apt-get -y install) into as few package manager transactions as
+    possible, each package once.
+    Every other command is a barrier: the packages requested before it are installed first, and those requested
+    after it are installed after it, so repository set-up such as epel keeps working. Commands run in the order
+    a serial install would run them, children first.
+    Components whose pre commands have been run this way do not run them again when installed.
+    Components which install() would skip (see Component.willskip), and their children, are left out, as are
+    those switched off by DiskPlan.
+
+    usage: PackageBatch(components, kind).run()
+    """
+
+    def __init__(self, components, kind="node", loud=True):
+        self.loud = loud
+        self.components = [c for c in InstallScheduler(components, kind=kind).components
+                           if c.willinstall(kind) and not c.status and not c.prerun]
+        skipped = set()
+
+        def _skip(component):
+            skipped.add(id(component))
+            if component.children is not None:
+                for child in component.children.get(linuxVersion, []):
+                    _skip(child)
+
+        # parents come after their children, and if a parent is skipped its children are never installed
+        for component in reversed(self.components):
+            if id(component) not in skipped and component.willskip():
+                _skip(component)
+        self.components = [c for c in self.components if id(c) not in skipped]
+        self.steps = []  # list of commands to run, in order
+        merged = {}  # merged command: packages, since the last barrier
+        seen = set()
+        for component in self.components:
+            for cmd in (component.pre or {}).get(linuxVersion, []):
+                plain = packageinstall(cmd)
+                if plain is None:
+                    self.steps = self.steps + self._flush(merged) + [cmd]
+                    merged = {}
                     continue
-            raise RuntimeError("Failed to copy from any source " + str(optional_froms))
-        afrom = optional_froms
-        self.run(copymethods(afrom, dest))
-        if not os.path.exists(dest):
-            raise IOError("Cannot copy from " + afrom.__str__())
+                for package in plain[1]:
+                    if (plain[0], package) not in seen:
+                        seen.add((plain[0], package))
+                        merged[plain[0]] = merged.get(plain[0], []) + [package]
+        self.steps = self.steps + self._flush(merged)
+
+    @staticmethod
+    def _flush(merged):
+        # groups first, they are the largest and the individual packages may depend on them
+        order = sorted(merged, key=lambda c: "groupinstall" not in c)
+        return [cmd + " " + " ".join([quote(p) for p in merged[cmd]]) for cmd in order]
+
+    def run(self):
+        """
+        Run all steps, raises a RuntimeError if any of them fails
+        """
+        with phase("packages", "pre"):
+            for cmd in self.steps:
+                with locked(command_lock(cmd)):
+                    if self.loud:
+                        throw_on_fail_loud(cmd)
+                    else:
+                        throw_on_fail_quiet(cmd)
+        for component in self.components:
+            component.prerun = True
         return True
 
-    def summary(self):
-        print(self.cname, " Summary :")
-        print("    Installing?", self.doInstall)
-        print("    To:", self.topdir, self.installSubDir, "i.e.:", self.todir())
-        print("    Version:", self.version)
-        print("    From:", self.src_from)
-        print("    Nodes?:", self.node)
-        print("    Workstations?:", self.workstation)
-        print("    Workstations Extras:", self.workstationExtras)
-        print("    Pre:", self.pre)
-        print("    Pre with environment file:", self.prewithenv)
-        print("    Post:", self.post)
-        print("    Post with environment file:", self.postwithenv)
-        print("    Options:", self.options)
-        print("----------------------------")
 
-    def script(self):
+#
+# Wheelhouse of python packages
+#
+
+
+def pipinstall(cmd):
+    """
+    Split a plain pip install command into its requirements, e.g. ['mrjob', '-r', 'requirements.txt'], or return
+    None for anything else, such as commands with other options, several commands or shell constructs
+    """
+    if len([c for c in ";|&<>$`()\n" if c in cmd]):
+        return None
+    try:
+        args = shlex.split(cmd)
+    except ValueError:
+        return None
+    if args[:2] != ["pip", "install"] or len(args) < 3:
+        return None
+    for i, arg in enumerate(args[2:]):
+        if arg.startswith("-") and (arg != "-r" or i + 3 >= len(args)):
+            return None
+    return args[2:]
+
+
+class Wheelhouse(object):
+    """
+    Local directory of built wheels, so that python packages are built once per host, then installed offline.
+    Under __cache_dir__ the wheels count towards the budget of the artifact cache, and are evicted with it.
+    Requirements are first installed from the wheelhouse alone, with pip --no-index. If anything is missing,
+    all requirements are resolved together in one pip download, which takes wheels from the wheels directory
+    of the mirrors where available, source distributions are built into wheels in parallel, and the install is
+    repeated offline.
+    Commands run in the python environment of the component installing, see Component.pipinstall
+    """
+
+    def __init__(self, directory=None, jobs=None):
+        if directory is None:
+            directory = os.path.join(__cache_dir__, "wheels", linuxVersion.lower())
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        self.directory = directory
+        self.jobs = jobs
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def links(self):
         """
-        Script method, if self.src_from is set then download it from the repo
-        execute downloaded shell scripts or python files, that is all
-        Complicated installs will overwrite this class.
+        Where to find wheels, the wheelhouse and then the configured mirrors, in the repo layout.
+        Discovered mirrors are left out, nothing would check their wheels against the repository manifest
         """
-        if self.src_from is None:
-            return False
-        afrom = self.src_from
-        if type(afrom) is list:
+        return [self.directory] + [repoURL("wheels/", arch=linuxVersion.lower(), repo=m) for m in __mirror_list__
+                                   if not discovered(m)]
+
+    def hosts(self):
+        """
+        The hosts of the links served over plain http, which pip only uses when told to trust them
+        """
+        hosts = []
+        for link in self.links():
+            host = urlsplit(link).netloc.split('@')[-1]
+            if link.startswith("http:") and host not in hosts:
+                hosts.append(host)
+        return hosts
+
+    def offline(self, requirements):
+        return ("pip install --no-index --find-links " + quote(self.directory) + " "
+                + ' '.join([quote(r) for r in requirements]))
+
+    def install(self, component, requirements, prefix="", check=True):
+        """
+        Install requirements, a list of pip install arguments, running commands in the environment of component.
+        prefix: shell commands to run before each pip command, e.g. exports
+        check: raise a RuntimeError if the install fails, otherwise return its status
+        """
+        if not component.withenv(prefix + self.offline(requirements))[0]:
+            return 0
+        run = component.withenv
+        if check:
+            run = component.runwithenv
+        with locked("wheelhouse"):
+            downloads = tempfile.mkdtemp(prefix="kave_wheels_")
             try:
-                afrom = [a for a in afrom if a is not None][0]
-            except IndexError:
-                return False
-        # default, get file, if it is a .sh file, run it
-        ext = ""
+                status = run(prefix + "pip download --dest " + quote(downloads) + " "
+                             + ' '.join(["--find-links " + quote(link) for link in self.links()]) + " "
+                             + ' '.join(["--trusted-host " + quote(host) for host in self.hosts()]) + " "
+                             + ' '.join([quote(r) for r in requirements]))
+                if not check and status[0]:
+                    return status[0]
+                sources = []
+                for name in os.listdir(downloads):
+                    if name.endswith(".whl"):
+                        shutil.move(os.path.join(downloads, name), os.path.join(self.directory, name))
+                    else:
+                        sources.append(os.path.join(downloads, name))
+                if sources:
+                    status = run(prefix + "printf '%s\\0' " + ' '.join([quote(source) for source in sources])
+                                 + " | xargs -0 -n 1 -P " + str(self.jobs) + " pip wheel --no-deps --no-index"
+                                 + " --find-links " + quote(self.directory) + " --wheel-dir " + quote(self.directory))
+                    if not check and status[0]:
+                        return status[0]
+            finally:
+                shutil.rmtree(downloads, ignore_errors=True)
+        status = run(prefix + self.offline(requirements))
+        cache = artifact_cache()
+        if cache is not None:
+            cache.evict()
+        if not check:
+            return status[0]
+        return 0
+
+
+__wheelhouse__ = []
+
+
+def wheelhouse():
+    """
+    The Wheelhouse under __cache_dir__, or None if the cache is disabled or not writable
+    """
+    if __cache_dir__ is None:
+        return None
+    directory = os.path.join(__cache_dir__, "wheels", linuxVersion.lower())
+    if not len(__wheelhouse__) or __wheelhouse__[0].directory != directory:
         try:
-            f = afrom.split("/")[-1].split('\\')[-1].split("?")[0]
-            if '.' in f:
-                ext = '.'.join(f.split(".")[1:])
-        except AttributeError:
-            print("warning, could not determine file extension, does the download location exist?")
-        dest = self.cname + '.' + ext
-        self.copy(self.src_from, dest)
-        if ext.endswith(".sh"):
-            os.system("chmod a+x " + dest)
-            self.run("./" + dest)
-        elif ext.endswith(".py"):
-            self.run("python ./" + dest)
-        elif ext.endswith(".tar.gz"):
-            self.run("tar -xzf ./" + dest)
-        elif ext.endswith(".tar"):
-            self.run("tar -xf ./" + dest)
-        elif ext.endswith(".rpm"):
-            self.run("rpm -i ./" + dest)
+            house = Wheelhouse(directory)
+        except (IOError, OSError):
+            return None
+        if not os.access(house.directory, os.W_OK):
+            return None
+        __wheelhouse__[:] = [house]
+    return __wheelhouse__[0]
+
+
+#
+# Parallel installation
+#
+
+
+def _scheduled_install(component, kind, tmpdir, loud):
+    """
+    Body of one forked installer process, the exit code tells the scheduler what happened
+    """
+    if tmpdir is not None:
+        os.chdir(tmpdir)
+    component.install(kind=kind, tmpdir=tmpdir, loud=loud)
+    if component.status:
+        sys.exit(0)
+    sys.exit(InstallScheduler.notinstalled)
+
+
+class InstallScheduler(object):
+    """
+    Install components as a dependency graph instead of strictly one after the other.
+
+    Each component depends on its children[linuxVersion], on the toolbox (which provides the environment script)
+    and on those components in its after list which are also being installed.
+    Components whose dependencies are satisfied are installed concurrently, at most workers at a time,
+    each in its own forked process with its own temporary directory.
+    Children shared between components, such as java or epel, are installed exactly once.
+    Package manager commands and environment script updates are serialised with locked().
+
+    usage: InstallScheduler(components, kind, tmpdir, loud, workers).run()
+    """
+    notinstalled = 3  # exit code of a component which was not installed, but did not fail either
+    poll = 0.2
+
+    def __init__(self, components, kind="node", tmpdir=None, loud=True, workers=3):
+        self.kind = kind
+        self.tmpdir = tmpdir
+        self.loud = loud
+        self.workers = max(int(workers), 1)
+        self.components = []  # install order if run serially, children first
+        self.deps = {}  # id(component): set of id(dependency)
+        self.failed = []
+        for component in components:
+            self._add(component)
+        scheduled = dict([(id(c), c) for c in self.components])
+        for component in self.components:
+            waitfor = list(component.after)
+            if component.toolbox is not None:
+                waitfor.append(component.toolbox)
+            for other in waitfor:
+                if id(other) in scheduled and id(component) not in self.requires(other):
+                    self.deps[id(component)].add(id(other))
+
+    def _add(self, component):
+        if id(component) in self.deps:
+            return
+        self.deps[id(component)] = set()
+        if component.willinstall(self.kind) and component.children is not None:
+            for child in component.children.get(linuxVersion, []):
+                child.register_toolbox(component.toolbox)
+                self._add(child)
+                self.deps[id(component)].add(id(child))
+        self.components.append(component)
+
+    def requires(self, component):
+        """
+        ids of everything which must be installed before this component, including itself
+        """
+        found = set([id(component)])
+        todo = [id(component)]
+        while todo:
+            for dep in self.deps.get(todo.pop(), []):
+                if dep not in found:
+                    found.add(dep)
+                    todo.append(dep)
+        return found
+
+    def _start(self, component):
+        tmpdir = None
+        if self.tmpdir is not None:
+            tmpdir = tempfile.mkdtemp(prefix=component.cname + '_', dir=self.tmpdir)
+        # fork explicitly, components are not picklable and the children need the state of this process
+        context = multiprocessing
+        if hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context('fork')
+        proc = context.Process(target=_scheduled_install, args=(component, self.kind, tmpdir, self.loud))
+        proc.start()
+        return proc
+
+    def run(self):
+        """
+        Install everything, raises a RuntimeError listing the failed components once all running installs end
+        """
+        global __lock_dir__
+        lockdir = self.tmpdir
+        if lockdir is None:
+            lockdir = tempfile.mkdtemp()
+        __lock_dir__ = lockdir
+        done = set([id(c) for c in self.components if c.status])
+        pending = [c for c in self.components if id(c) not in done]
+        running = {}
+        try:
+            while pending or running:
+                for component in [c for c in pending if self.deps[id(c)].issubset(done)]:
+                    if len(running) >= self.workers or self.failed:
+                        break
+                    pending.remove(component)
+                    running[id(component)] = (component, self._start(component))
+                if not running:
+                    break
+                time.sleep(self.poll)
+                for key, (component, proc) in list(running.items()):
+                    if proc.is_alive():
+                        continue
+                    proc.join()
+                    del running[key]
+                    if proc.exitcode == 0:
+                        component.status = True
+                        done.add(key)
+                        # what it installed may change what the skip rules of the next ones import
+                        forget_imports()
+                    elif proc.exitcode == self.notinstalled:
+                        done.add(key)
+                    else:
+                        self.failed.append(component)
+        finally:
+            __lock_dir__ = None
+            if lockdir != self.tmpdir:
+                os.system("rm -rf " + lockdir)
+        if self.failed or pending:
+            raise RuntimeError("Failed to install " + str([c.cname for c in self.failed])
+                               + ", not attempted " + str([c.cname for c in pending]))
         return True
 
-    def todir(self):
+
+#
+# Installation on many hosts
+#
+
+# how to run a command on a host, {host} and {command} are replaced by the quoted host name and command
+__host_command__ = "ssh -o BatchMode=yes {host} {command}"
+# the line KaveInstall prints with the exit code of the post-installation tests
+__tests_status__ = "Post-installation tests exit code:"
+
+
+class FleetInstall(object):
+    """
+    Run KaveInstall on many hosts at once, at most workers at a time, each through the host command template
+    (ssh by default). The local /etc/kave/CustomInstall.py and /etc/kave/requirements.txt are sent along and
+    installed on each host first, so that one configuration drives the whole fleet. KaveInstall is expected at the
+    same location on every host.
+    The output of every host is printed as it arrives, prefixed by the host name. A host fails if KaveInstall
+    fails or its post-installation tests fail, and is then retried up to retries times.
+
+    usage: FleetInstall(hosts, ["--node", "spark"]).run()
+    """
+
+    def __init__(self, hosts, arguments, template=None, workers=10, retries=1, installer=None,
+                 config=["/etc/kave/CustomInstall.py", "/etc/kave/requirements.txt"]):
+        self.hosts = hosts
+        self.arguments = arguments
+        self.template = template
+        if self.template is None:
+            self.template = __host_command__
+        self.workers = max(int(workers), 1)
+        self.retries = retries
+        self.installer = installer
+        if self.installer is None:
+            self.installer = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "scripts", "KaveInstall")
+        self.config = [c for c in config if os.path.exists(c)]
+        self.results = {}  # host: (exit code, tests exit code or None, attempts)
+        self._lock = threading.Lock()
+
+    def command(self):
+        """
+        The command run on each host: write the configuration files, then run the installer
+        """
+        steps = []
+        for path in self.config:
+            with open(path, 'rb') as fp:
+                content = base64.b64encode(fp.read()).decode('ascii')
+            steps.append("mkdir -p " + quote(os.path.dirname(path)) + " && echo " + content + " | base64 -d > "
+                         + quote(path))
+        steps.append(' '.join([quote(a) for a in [self.installer] + self.arguments]))
+        return ' && '.join(steps)
+
+    def _say(self, host, line):
+        with self._lock:
+            sys.stdout.write("[" + host + "] " + line)
+            sys.stdout.flush()
+
+    def attempt(self, host):
+        """
+        Install on one host once, returns (exit code, tests exit code or None)
+        """
+        cmd = self.template.format(host=quote(host), command=quote(self.command()))
+        __stats__["subprocesses"] += 1
+        tests = None
+        with open(os.devnull) as devnull:
+            proc = sub.Popen(cmd, shell=True, stdin=devnull, stdout=sub.PIPE, stderr=sub.STDOUT)
+            for line in iter(proc.stdout.readline, b''):
+                line = line.decode('utf-8', 'replace')
+                if line.startswith(__tests_status__):
+                    tests = int(line.split()[-1])
+                self._say(host, line)
+            proc.stdout.close()
+            return proc.wait(), tests
+
+    def install(self, host):
+        attempts = 0
+        while True:
+            attempts += 1
+            status, tests = self.attempt(host)
+            self.results[host] = (status, tests, attempts)
+            if not status and not tests:
+                return
+            if attempts > self.retries:
+                return
+            self._say(host, "failed with exit code " + str(status) + ", tests " + str(tests) + ", retrying\n")
+
+    def failed(self):
+        return sorted([h for h, (status, tests, _a) in self.results.items() if status or tests])
+
+    def run(self):
+        """
+        Install on all hosts, print a summary and return True if all succeeded
+        """
+        pending = list(self.hosts)
+
+        def worker():
+            while True:
+                with self._lock:
+                    if not pending:
+                        return
+                    host = pending.pop(0)
+                self.install(host)
+
+        threads = [threading.Thread(target=worker) for _i in range(min(self.workers, len(pending)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sys.stdout.write("%-30s %10s %10s %10s\n" % ("host", "exit code", "tests", "attempts"))
+        for host in self.hosts:
+            status, tests, attempts = self.results[host]
+            sys.stdout.write("%-30s %10s %10s %10d\n" % (host, status, tests, attempts))
+        return not self.failed()
+
+
+#
+# Serving the cache to other hosts
+#
+
+__discovery_request__ = b"KAVE-MIRROR?"
+__discovery_reply__ = b"KAVE-MIRROR "
+
+
+def discover_mirrors(timeout=0.5, port=None, address='<broadcast>'):
+    """
+    Find the hosts running KaveMirror serve on the local network, with a UDP broadcast, and add them to the
+    mirror list. Returns the mirrors found.
+    Any host can answer, so files from these mirrors are only used when the manifest of the repository has their
+    checksum, and are checked against it, see trusted. Only done when asked for, KaveInstall --discover.
+    """
+    if port is None:
+        port = __mirror_port__
+    if port is None:
+        return []
+    found = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.settimeout(timeout)
+        sock.sendto(__discovery_request__, (address, port))
+        end = time.time() + timeout
+        while time.time() < end:
+            sock.settimeout(max(end - time.time(), 0.01))
+            data, sender = sock.recvfrom(1024)
+            if not data.startswith(__discovery_reply__):
+                continue
+            mirror = "http://" + sender[0] + ":" + str(data[len(__discovery_reply__):].decode('ascii').strip()) + "/"
+            if mirror not in found:
+                found.append(mirror)
+    except (socket.error, socket.timeout, ValueError):
+        pass
+    finally:
+        sock.close()
+    for mirror in found:
+        # mirrors configured in __mirror_list_file__ are trusted as before
+        if mirror not in __mirror_list__:
+            __mirror_list__.append(mirror)
+            __discovered_mirrors__.append(mirror)
+    return found
+
+
+class _Limited(object):
+    """
+    Read at most size bytes of an open file
+    """
+
+    def __init__(self, fp, size):
+        self.fp = fp
+        self.size = size
+
+    def read(self, n=-1):
+        if n < 0 or n > self.size:
+            n = self.size
+        data = self.fp.read(n)
+        self.size -= len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class _Pull(object):
+    """
+    A file being fetched from upstream by the mirror server, which can be read while it grows
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.written = 0
+        self.done = False
+        self.cond = threading.Condition()
+        self.fp = open(path, 'wb')
+
+    def write(self, data):
+        self.fp.write(data)
+        self.fp.flush()
+        with self.cond:
+            self.written += len(data)
+            self.cond.notify_all()
+
+    def finish(self):
+        self.fp.close()
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def reader(self):
+        return _Following(self)
+
+
+class _Following(object):
+    """
+    Read a _Pull from the start, waiting for data until it is finished
+    """
+
+    def __init__(self, pull):
+        self.pull = pull
+        self.fp = open(pull.path, 'rb')
+        self.pos = 0
+
+    def read(self, n=-1):
+        with self.pull.cond:
+            while self.pull.written <= self.pos and not self.pull.done:
+                self.pull.cond.wait(1)
+            available = self.pull.written - self.pos
+        if n < 0 or n > available:
+            n = available
+        data = self.fp.read(n)
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class _MirrorHandler(SimpleHTTPRequestHandler):
+    """
+    Serves a MirrorServer, supporting HEAD, GET and single byte ranges
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.mirror.verbose:
+            SimpleHTTPRequestHandler.log_message(self, format, *args)
+
+    def _headers(self, status, size, extra=[]):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        for name, value in extra:
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _document(self, text, kind):
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def send_head(self):
+        mirror = self.server.mirror
+        path = unquote(urlsplit(self.path).path).lstrip('/')
+        if path == __manifest_name__:
+            return self._document(mirror.manifest().dumps(), "application/json")
+        if path.endswith('/') or not len(path):
+            listing = mirror.listing(path)
+            if listing is None:
+                self.send_error(404, "Not found")
+                return None
+            return self._document(listing, "text/html")
+        if self.command == 'HEAD':
+            local = mirror.resolve(path, pull=False)
+        else:
+            local = mirror.resolve(path)
+        if local is None and self.command == 'HEAD':
+            # only say whether it can be fetched, without fetching it
+            size = mirror.upstream_size(path)
+            if size is None:
+                self.send_error(404, "Not found")
+                return None
+            self._headers(200, size)
+            return None
+        if local is None:
+            self.send_error(404, "Not found")
+            return None
+        if isinstance(local, _Pull):
+            if self.headers.get('Range'):
+                self.send_error(503, "Being fetched, try again later")
+                return None
+            self._headers(200, local.size)
+            return local.reader()
+        size = os.path.getsize(local)
+        first, last = 0, size - 1
+        ranged = self.headers.get('Range')
+        if ranged and ranged.startswith('bytes=') and ',' not in ranged:
+            try:
+                start, end = ranged[len('bytes='):].split('-', 1)
+                if not len(start):
+                    first = max(size - int(end), 0)
+                else:
+                    first = int(start)
+                    if len(end):
+                        last = min(int(end), size - 1)
+            except ValueError:
+                ranged = None
+            if ranged and first > last:
+                self.send_error(416, "Requested range not satisfiable")
+                return None
+        else:
+            ranged = None
+        extra = [("Accept-Ranges", "bytes")]
+        if ranged:
+            extra.append(("Content-Range", "bytes %d-%d/%d" % (first, last, size)))
+            self._headers(206, last - first + 1, extra)
+        else:
+            self._headers(200, size, extra)
+        fp = open(local, 'rb')
+        fp.seek(first)
+        return _Limited(fp, last - first + 1)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MirrorServer(object):
+    """
+    Serve the artifact cache of this host over HTTP in the repository layout, <arch>/KaveToolbox/<version>/<file>,
+    so that other hosts can use it as a mirror, and the built wheels under <arch>/KaveToolbox/<version>/wheels/.
+    A file which is not cached yet is fetched from upstream (the repository, or the mirrors in /etc/kave/mirror)
+    once, and streamed to every host asking for it while it arrives, then kept in the cache. So when many hosts
+    install at once, only this one downloads from outside.
+    Also answers discovery broadcasts on the same port over UDP, see discover_mirrors.
+
+    usage: MirrorServer(artifact_cache()).serve_forever()
+    """
+
+    def __init__(self, cache, port=None, upstream=True, verbose=False):
+        if port is None:
+            port = __mirror_port__
+        self.cache = cache
+        self.upstream = upstream
+        self.verbose = verbose
+        self.verified = {}  # path: cached object already checked
+        self.pulls = {}  # path: _Pull in progress
+        self._lock = threading.Lock()
+        self.httpd = _ThreadingHTTPServer(('', port), _MirrorHandler)
+        self.httpd.mirror = self
+        self.port = self.httpd.server_address[1]
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.udp.bind(('', self.port))
+
+    def _upstreams(self, path):
+        return alternatives(__repo_url__.rstrip('/') + '/' + path)
+
+    def upstream_size(self, path):
         """
-        It's often complex to interpret exactly where a component will be installed,
-        this method does just that and caches the result.
+        The size of a file upstream, None if it is not there or fetching from upstream is disabled
         """
-        if self.installDir is not None:
-            return self.installDir
-        if self.installSubDir is not None and self.topdir is not None:
-            return (self.topdir + os.sep + self.installSubDir).replace("//", "/")
-        if self.topdir is not None:
-            return self.topdir
-        if self.topdir is None and self.installSubDir is not None:
-            return (InstallTopDir + os.sep + self.installSubDir).replace("//", "/")
-        if self.topdir is None:
-            return InstallTopDir
+        if not self.upstream:
+            return None
+        for source in self._upstreams(path):
+            try:
+                status, headers, _seconds = http_transport().head(source)
+            except IOError:
+                continue
+            if status == 200 and 'content-length' in headers:
+                return int(headers['content-length'])
         return None
 
-    def checkadisk(self, disk, space):
+    def wheel(self, path):
         """
-        Check that so much space is available on a disk containing a given directory
+        The wheelhouse file for a path <arch>/KaveToolbox/<version>/wheels/<file>, or None for other paths
         """
-        # check inodes
-        free_inodes = df(disk, ['-i'])
-        free = int(free_inodes[3])
-        if free < 100:
-            raise OSError("No free inodes on mount point " + free_inodes[-1] + " to install " + self.cname)
-        free_space = df(disk, ['-m'])
-        free = int(free_space[3])
-        if free < space:
-            raise OSError("Not enough space on mount point " + str(free_space[-1]) + " to install " + self.cname
-                          + " (" + disk + "). Skip the installation, cleanup, or add more disk space, an additional "
-                          + str(space - free) + " MB is needed")
-        return free_space[-1]
+        parts = path.split('/')
+        if __cache_dir__ is None or len(parts) != 5 or parts[1] != __main_dir__ or parts[3] != "wheels":
+            return None
+        return os.path.join(__cache_dir__, "wheels", parts[0], parts[4])
 
-    def clean(self, others_only=False):
-        if self.installDir is not None and os.path.exists(self.installDir):
-            if not others_only:
-                print("Force-cleaning installation directory as requested")
-                if len(self.installDirPro) > 4 and os.path.islink(self.installDirPro):
-                    self.run("rm -f " + self.installDirPro)
-                if len(self.installDirPro) > 4 and os.path.exists(self.installDirPro):
-                    self.run("rm -rf " + self.installDirPro)
-                if len(self.installDirVersion) > 4 and os.path.exists(self.installDirVersion):
-                    self.run("rm -rf " + self.installDirVersion)
-                if (len(self.installDir) > 4 and (os.path.exists(self.installDir)
-                                                  and (os.path.realpath(self.installDir)
-                                                       != os.path.realpath(self.topdir)))):
-                    self.run("rm -rf " + self.installDir)
-            else:
-                print("Force-cleaning obsolete installations as requested")
-                import glob
-                dirs = glob.glob(self.installDir + '/*')
-                cleaning = [os.path.realpath(d) for d in dirs if os.path.realpath(d)
-                            not in [os.path.realpath(self.installDir),
-                                    os.path.realpath(self.installDirVersion),
-                                    os.path.realpath(self.installDirPro)]]
-                cleaning = [d for d in cleaning if len(d) > 4 and os.path.isdir(d)]
-                [self.run("rm -rf " + d) for d in cleaning if os.path.isdir(d)]
-            return True
-        return False
+    def listing(self, path):
+        """
+        A html page linking to the wheels in a wheels/ directory, which pip --find-links can read
+        """
+        wheels = self.wheel(path)
+        if wheels is None or not os.path.isdir(wheels):
+            return None
+        links = ['<a href="' + name + '">' + name + '</a><br/>\n' for name in sorted(os.listdir(wheels))
+                 if name.endswith('.whl')]
+        return "<html><body>\n" + ''.join(links) + "</body></html>\n"
 
-    def __checkdloop(self, mounts):
+    def manifest(self):
         """
-        Loop to check for disk space, expect OSError if not enough space
+        The RepoManifest of what this mirror serves: everything upstream, if fetching from there is enabled and it
+        has a manifest, and the files of the repository which are in the cache
         """
-        checked_mounts = {}
-        for k, v in mounts.items():
-            mnt = self.checkadisk(k, v)
-            try:
-                checked_mounts[mnt] = checked_mounts[mnt] + v
-            except KeyError:
-                checked_mounts[mnt] = v
-        if len(checked_mounts) < len(mounts):
-            [self.checkadisk(k, v) for k, v in checked_mounts.iteritems()]
-        return checked_mounts
+        manifest = RepoManifest()
+        if self.upstream:
+            for mirror in [m for m in __mirror_list__ + [__repo_url__] if isremote(m)]:
+                found = repo_manifest(mirror)
+                if found is not None:
+                    manifest.files.update(found.files)
+        for path, size, checksum in self.cache.entries():
+            parts = path.split('/')
+            if len(parts) >= 4 and parts[1] == __main_dir__ and path not in manifest.files:
+                manifest.files[path] = RepoManifest.entry(path, size, checksum)
+        return manifest
 
-    def constinstdir(self):
+    def resolve(self, path, pull=True):
         """
-        Construct the installation directory
+        The local file to serve for path, a _Pull while it is being fetched, or None
         """
-        if self.installDir is None:
-            self.installDir = self.todir()
-            self.installDirVersion = (self.installDir + os.sep + self.version).replace("//", "/")
-            self.installDirPro = (self.installDir + os.sep + 'pro').replace("//", "/")
+        if '..' in path.split('/'):
+            return None
+        wheel = self.wheel(path)
+        if wheel is not None:
+            if os.path.isfile(wheel):
+                return wheel
+            return None
+        with self._lock:
+            if path in self.pulls:
+                return self.pulls[path]
+            known = self.verified.get(path)
+        if known is not None and os.path.exists(known):
+            return known
+        # checks the content against its checksum, once
+        local = self.cache.lookup(path)
+        if local is not None:
+            with self._lock:
+                self.verified[path] = local
+            return local
+        if not pull or not self.upstream:
+            return None
+        return self.pull(path)
 
-    def skipif(self):
+    def pull(self, path):
         """
-        Rules which cause the skipping of installation of a package
-        by default, False
+        Start fetching path from upstream into the cache, returns the _Pull, or None if it is not upstream
         """
-        return False
+        size = self.upstream_size(path)
+        if size is None:
+            return None
+        with self._lock:
+            if path in self.pulls:
+                return self.pulls[path]
+            pulling = _Pull(self.cache.partial(path) + '.pull', size)
+            self.pulls[path] = pulling
 
-    def install(self, kind="node", tmpdir=None, loud=True):
+        def _fetch():
+            try:
+                for source in self._upstreams(path):
+                    try:
+                        _nbytes, checksum = HTTPTransport().pipe(source, [pulling])
+                    except IOError:
+                        if pulling.written:
+                            break
+                        continue
+                    pulling.fp.close()
+                    self.cache.put(path, pulling.path, checksum=checksum)
+                    break
+            finally:
+                pulling.finish()
+                with self._lock:
+                    del self.pulls[path]
+                if os.path.exists(pulling.path):
+                    os.remove(pulling.path)
+
+        thread = threading.Thread(target=_fetch)
+        thread.daemon = True
+        thread.start()
+        return pulling
+
+    def _answer(self):
+        while True:
+            try:
+                data, sender = self.udp.recvfrom(1024)
+            except socket.error:
+                return
+            if data.strip() == __discovery_request__:
+                self.udp.sendto(__discovery_reply__ + str(self.port).encode('ascii'), sender)
+
+    def serve_forever(self):
+        thread = threading.Thread(target=self._answer)
+        thread.daemon = True
+        thread.start()
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.udp.close()
+
+
+#
+# Pre-seeding a mirror
+#
+
+# file in a synced mirror directory recording what was downloaded, to skip it next time
+__sync_state__ = ".kave-sync.json"
+
+
+def mirror_files(components):
+    """
+    The files a mirror needs to install these components, and their children, on this linuxVersion,
+    a sorted list of {"path": path in the repository, "urls": other sources of the same file, "component": name}
+    Nothing is looked up, so this also works for another OS, with KAVE_LINUX_VERSION set
+    """
+    found = {}
+    seen = set()
+
+    def _walk(component):
+        if id(component) in seen or not (component.willinstall("node") or component.willinstall("workstation")):
+            return
+        seen.add(id(component))
+        if component.children is not None:
+            for child in component.children.get(linuxVersion, []):
+                _walk(child)
+        for path, urls in component.mirrorfiles():
+            known = found.setdefault(path, {"path": path, "urls": [], "component": component.cname})
+            known["urls"].extend([u for u in urls if u not in known["urls"]])
+
+    for component in components:
+        _walk(component)
+    return [found[path] for path in sorted(found)]
+
+
+class Throttle(object):
+    """
+    Bandwidth cap of rate bytes per second, shared by all threads writing through it
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.lock = threading.Lock()
+        self.next = time.time()
+
+    def wait(self, nbytes):
         """
-        Used by the installer, eventually calls the script method
-        It is not usual for component derived classes to override this method,
-        since they override the pre, post and script() classes instead
+        Account for nbytes, sleeping as long as needed to stay under the rate
         """
-        self.odir = os.path.realpath(os.curdir)
-        self.kind = kind
-        if self.topdir is None:
-            self.topdir = InstallTopDir
-        self.tmpdir = tmpdir
-        self.loud = loud
-        self.constinstdir()
-        if not self.doInstall:
-            return False
-        if self.kind is "node" and not self.node:
-            return False
-        if self.kind is "workstation" and not self.workstation:
-            return False
-        if self.installDir is not None and os.path.exists(self.installDir) and (self.installDir != self.topdir):
-            if self.cleanBefore:
-                self.clean()
-            if os.path.isdir(self.installDirVersion):
-                print("Skipping", self.cname, "because this version is already installed")
-                print("remove", self.installDirVersion, "if you want to force re-install")
-                self.buildenv()
-                return self.__install_end_actions()
-                # Detect previous KTB installation and skip
-            if (os.path.exists(self.installDir) and not os.path.exists(self.installDirPro)
-                    and not os.path.islink(self.installDirPro) and len(os.listdir(self.installDir))):
-                print("Skipping", self.cname, "because a 1.X-KTB version was already installed")
-                print("remove", self.installDir, "if you want to force re-install")
-                return False
-        # additional user-defined skipping
-        if self.skipif():
-            print("Skipping", self.cname, "because a custom skip rule asked to, e.g. already installed")
-            self.buildenv()
-            return self.__install_end_actions()
-        ##############################
-        # Check disk space
-        ##############################
-        free_disk = None
-        mounts = {}
-        if self.freespace:
-            if self.installDir:
-                mounts[self.installDir] = self.freespace
-            else:
-                mounts['/'] = self.freespace
-        if self.tempspace:
-            if self.tmpdir:
-                mounts[self.tmpdir] = self.tempspace
-            else:
-                mounts['/tmp'] = self.tempspace
-        if self.usrspace:
-            mounts['/usr'] = self.usrspace
-        # Check these mountpoints and clean if requested
-        try:
-            self.__checkdloop(mounts)
-        except OSError as e:
-            if self.cleanIfDiskFull:
-                self.clean()
-        # Check again and skip if requested
+        with self.lock:
+            start = max(self.next, time.time())
+            self.next = start + nbytes / self.rate
+            until = self.next
+        delay = until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _Throttled(object):
+    """
+    Write to an open file no faster than a Throttle allows
+    """
+
+    def __init__(self, fp, throttle):
+        self.fp = fp
+        self.throttle = throttle
+
+    def write(self, data):
+        self.fp.write(data)
+        if self.throttle is not None:
+            self.throttle.wait(len(data))
+
+
+class MirrorSync(object):
+    """
+    Bring a directory in the repository layout up to date with the repository, for a list of files from
+    mirror_files, so that it can be served as a nearside mirror (see KaveInstall --help), or carried to an
+    air-gapped site.
+    Downloads jobs files at once, at most limit bytes per second over all of them, and only files which are
+    missing or changed: the size and ETag (or Last-Modified) of each file are recorded in dest/.kave-sync.json,
+    with its sha256, and compared to those upstream. With verify, also re-checks the sha256 of the files on disk.
+    When the repository has a manifest, files whose sha256 is listed there are checked against it instead.
+    Files are written next to their destination and moved in place when complete, so an interrupted sync
+    can simply be run again. Finally writes the manifest of dest, so that it is a mirror with a manifest.
+
+    usage: MirrorSync("/srv/mirror", jobs=4, limit=10 * 1024 ** 2).run(mirror_files(components))
+    """
+
+    def __init__(self, dest, jobs=4, limit=None, verify=False):
+        self.dest = dest
+        self.jobs = jobs
+        self.verify = verify
+        self.throttle = None
+        if limit:
+            self.throttle = Throttle(limit)
+        self.lock = threading.Lock()
+        self.state = {}
+        self.results = {}  # path: (what happened, bytes downloaded)
         try:
-            self.__checkdloop(mounts)
-        except OSError as e:
-            if self.skipIfDiskFull:
-                print("Skipping", self.cname, "because of insufficient disk space")
-                print(e)
-                return self.buildenv()
-            raise e
-        ##############################
-        # Install children
-        ##############################
-        if self.children is not None and linuxVersion in self.children:
-            for child in self.children[linuxVersion]:
-                child.register_toolbox(self.toolbox)
-                if not child.status:
-                    child.install(kind=self.kind, tmpdir=self.tmpdir, loud=self.loud)
-        ##############################
-        # run prerequisites
-        ##############################
-        print("Installing", self.cname)
-        if self.pre is not None and linuxVersion in self.pre:
-            for cmd in self.pre[linuxVersion]:
-                self.run(cmd)
-        # run prerequisites that require the environment
-        if self.prewithenv is not None and linuxVersion in self.prewithenv:
-            for cmd in self.prewithenv[linuxVersion]:
-                self.run("bash -c 'source " + self.toolbox.envscript() + " > /dev/null ;" + cmd + ";'")
-        # run workstation extras
-        if (self.kind is "workstation" and (self.workstationExtras is not None
-                                            and linuxVersion in self.workstationExtras)):
-            for cmd in self.workstationExtras[linuxVersion]:
-                self.run(cmd)
-        if self.installDir is not None and self.installDirVersion.count('/') > 1:
-            self.run("mkdir -p " + os.sep.join(self.installDirVersion.split(os.sep)[:-1]))
-        # Find the places to download from
-        self.fillsrc()
-        # run script :)
-        self.script()
-        # run post actions
-        if self.post is not None and linuxVersion in self.post:
-            for cmd in self.post[linuxVersion]:
-                self.run(cmd)
-        self.buildenv()
-        # run post actions that require the environment
-        if self.postwithenv is not None and linuxVersion in self.postwithenv:
-            for cmd in self.postwithenv[linuxVersion]:
-                self.run("bash -c 'source " + self.toolbox.envscript() + " > /dev/null ;" + cmd + ";'")
-        os.chdir(self.odir)
-        if self.installDir is not None and self.installDir.count('/') > 1 and os.path.exists(self.installDir):
-            self.run("chmod -R a+rx " + self.installDir)
-        return self.__install_end_actions()
+            with open(os.path.join(dest, __sync_state__)) as fp:
+                self.state = json.load(fp)
+        except (IOError, OSError, ValueError):
+            self.state = {}
 
-    def __install_end_actions(self):
-        self.status = True
-        # create pro softlink
-        if self.installDir is not None:
-            if ((os.path.exists(self.installDirPro) or os.path.islink(self.installDirPro))
-                    and os.path.exists(self.installDirVersion)):
-                os.system("rm " + self.installDirPro)
-            if os.path.exists(self.installDirVersion):
-                os.system("ln -s " + self.installDirVersion + " " + self.installDirPro)
+    def save(self):
+        path = os.path.join(self.dest, __sync_state__)
+        with open(path + '.' + str(os.getpid()), 'w') as fp:
+            json.dump(self.state, fp, indent=1, sort_keys=True)
+        os.rename(path + '.' + str(os.getpid()), path)
 
-        # clean the temporary directory of files I created
-        if self.tmpdir is not None:
-            if os.path.exists(self.tmpdir) and len(self.tmpdir) > 4:
-                os.system("rm -rf " + self.tmpdir + '/*')
-        if self.installDir is not None and os.path.exists(self.installDir) and (self.installDir != self.topdir):
-            if self.cleanAfter:
-                self.clean(others_only=True)
-        return True
+    def sources(self, entry):
+        return alternatives(__repo_url__.rstrip('/') + '/' + entry["path"]) + entry.get("urls", [])
 
-    def register_toolbox(self, toolbox):
+    def remote(self, sources):
         """
-        The method of finding the env script must be known by components, and so the Component which installs
-        KaveToolbox itself needs to be remembered and resolved at runtime
+        The first source which has the file, with its size and tag, (source, size, tag), or None
         """
-        self.toolbox = toolbox
+        for source in sources:
+            try:
+                status, headers, _seconds = http_transport().head(source)
+            except IOError:
+                continue
+            if status == 200:
+                size = headers.get('content-length')
+                return source, (int(size) if size is not None else None), headers.get(
+                    'etag', headers.get('last-modified'))
+        return None
 
-    def knownreplaces(self, stringtosearch):
-        self.constinstdir()
-        e = stringtosearch.replace("%%INSTALLDIR%%", self.installDir)
-        e = e.replace("%%INSTALLDIRPRO%%", self.installDirPro)
-        e = e.replace("%%INSTALLDIRVERSION%%", self.installDirVersion)
-        e = e.replace("%%VERSION%%", self.version)
-        return e
+    def record(self, path, **values):
+        with self.lock:
+            self.state.setdefault(path, {}).update([(k, v) for k, v in values.items() if v is not None])
+            self.save()
 
-    def buildenv(self):
+    def unchanged(self, path, size, tag, key='tag'):
         """
-        Build env adds to the standard environment script the contents of self.env
-        in order to build a static env file (fastest approach) this method can autoreplace the key
-        to determine the installed package directory
-        self.env.replace("%%INSTALLDIR%%", self.todir())
+        Is what we have of path, according to the state, the same as upstream, judged by the size and the tag
+        (or another key of the state)?
         """
-        if self.toolbox is None:
-            return
-        if not len(self.env):
-            return
-        loc = self.toolbox.envscript().split()[0]
-        if not len(loc):
-            return
-        f = open(loc)
-        lines = f.readlines()
-        f.close()
-        beforelines = []
-        afterlines = []
-        for line in lines:
-            if line.strip() == "## Begin " + self.cname:
-                break
-            beforelines.append(line)
-        found = False
-        for line in lines:
-            if line.strip() == "## End " + self.cname:
-                found = True
-                continue
-            if not found:
-                continue
-            afterlines.append(line)
-        f = open(loc, 'w')
-        f.write(''.join(beforelines))
-        f.write("## Begin " + self.cname + '\n')
-        f.write('#\n')
-        e = self.knownreplaces(self.env)
-        f.write(e)
-        f.write('#\n')
-        f.write("## End " + self.cname + '\n')
-        f.write(''.join(afterlines))
-        f.close()
-        return True
+        known = self.state.get(path)
+        target = os.path.join(self.dest, path)
+        if known is None or not os.path.isfile(target) or os.path.getsize(target) != known['size']:
+            return False
+        if size not in [None, known['size']] or tag is None or known.get(key) != tag:
+            return False
+        return not self.verify or sha256sum(target) == known['sha256']
 
-    def run(self, cmd):
+    def sync(self, entry):
         """
-        Intelligently run a command, either cleaning or exiting if the command fails
+        Download one file of mirror_files if it is missing or changed, returns what happened and the bytes downloaded
         """
-        if self.tmpdir is not None and os.path.exists(self.tmpdir):
-            return self._clean_on_fail(cmd, self.tmpdir)
-        self._throw_on_fail(cmd)
+        path = entry["path"]
+        sources = self.sources(entry)
+        listed = manifest_entry(sources[0])
+        if listed is not None and self.unchanged(path, listed['size'], listed['sha256'], key='sha256'):
+            self.record(path, component=entry.get("component"))
+            return "unchanged", 0
+        found = self.remote(sources)
+        if found is None:
+            raise IOError("No source has " + path + ", tried " + str(sources))
+        source, size, tag = found
+        if self.unchanged(path, size, tag):
+            return "unchanged", 0
+        target = os.path.join(self.dest, path)
+        if not os.path.isdir(os.path.dirname(target)):
+            try:
+                os.makedirs(os.path.dirname(target))
+            except OSError:
+                # another thread made it first
+                pass
+        partial = target + '.part'
+        errors = []
+        for source in [source] + [s for s in sources if s != source]:
+            try:
+                with open(partial, 'wb') as fp:
+                    nbytes, checksum = http_transport().pipe(source, [_Throttled(fp, self.throttle)])
+            except IOError as e:
+                errors.append(str(e))
+                continue
+            if size not in [None, nbytes]:
+                errors.append("Incomplete download of " + source)
+                continue
+            if listed and checksum != listed['sha256']:
+                errors.append("Download from " + source + " does not match the manifest")
+                continue
+            os.rename(partial, target)
+            self.record(path, size=nbytes, tag=tag, sha256=checksum, component=entry.get("component"))
+            return "downloaded", nbytes
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise IOError("Problem downloading " + path + ": " + str(errors))
 
-    def bauk(self, reason):
+    def run(self, entries):
         """
-        Exit and raise runtime error after cleaning my temporary directory
+        Sync all entries of mirror_files, print a summary, returns True if everything is now in place
         """
-        if self.tmpdir is not None:
-            if os.path.exists(self.tmpdir) and len(self.tmpdir) > 4:
-                os.system("rm -rf " + self.tmpdir)
-        raise RuntimeError(reason)
+        if not os.path.isdir(self.dest):
+            os.makedirs(self.dest)
+        todo = queue.Queue()
+        for entry in entries:
+            todo.put(entry)
 
-    def _throw_on_fail(self, cmd):
-        if self.loud:
-            return throw_on_fail_loud(cmd)
-        throw_on_fail_quiet(cmd)
+        def _work():
+            while True:
+                try:
+                    entry = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    result = self.sync(entry)
+                except (IOError, OSError) as e:
+                    result = ("failed: " + str(e), 0)
+                with self.lock:
+                    self.results[entry["path"]] = result
+                sys.stdout.write("%-12s %s\n" % (result[0].split(':')[0], entry["path"]))
+                sys.stdout.flush()
 
-    def _clean_on_fail(self, cmd, dir):
-        if self.loud:
-            return clean_on_fail_loud(cmd, dir)
-        clean_on_fail_quiet(cmd, dir)
+        threads = [threading.Thread(target=_work) for _i in range(max(min(self.jobs, len(entries)), 1))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        RepoManifest.build(self.dest, self.state).write(self.dest)
+        failed = self.failed()
+        for path in failed:
+            sys.stdout.write("Failed " + path + ": " + self.results[path][0][len("failed: "):] + "\n")
+        downloaded = [r for r in self.results.values() if r[0] == "downloaded"]
+        sys.stdout.write("%d files, %d downloaded (%d bytes), %d unchanged, %d failed\n"
+                         % (len(self.results), len(downloaded), sum([r[1] for r in downloaded]),
+                            len([r for r in self.results.values() if r[0] == "unchanged"]), len(failed)))
+        return not len(failed)
+
+    def failed(self):
+        return sorted([path for path, result in self.results.items() if result[0].startswith("failed")])
@@ -61,10 +61,15 @@ if [ ! -z "$HOME" ]; then
 	fi
 fi
 
-# %ENVSCRIPT% will be replaced when this file is copied to /etc/profile.d/
+# %ENVSCRIPT% and %COMPILEDENV% will be replaced when this file is copied to /etc/profile.d/
+# %COMPILEDENV% is a much faster snapshot of %ENVSCRIPT%, made by the installer, used while it is up to date
 
 if [ -e %ENVSCRIPT% ]; then
 	if [ ${autoFire} == 'yes' ]; then
-	 	 source %ENVSCRIPT%
+		if [ %COMPILEDENV% -nt %ENVSCRIPT% ]; then
+			source %COMPILEDENV%
+		else
+			source %ENVSCRIPT%
+		fi
 	fi
 fi
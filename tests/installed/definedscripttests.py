@@ -32,6 +32,7 @@ import kaveinstall as ki
 class TestOneInstalledComponent(unittest.TestCase):
     component = None
     kind = 'workstation'
+    modules = []  # imported by the import-only tests of all components, probed together
 
     def id(self):
         return "gaaaah"
@@ -45,6 +46,8 @@ class TestOneInstalledComponent(unittest.TestCase):
 
         The command can have the %%INSTALLDIR%%,%%INSTALLDIRPRO%%,%%INSTALLDIRVERSION%%
         directives for search/replace
+        Tests which only import python modules are answered from one interpreter importing the modules of all
+        of them, see kaveinstall.probe_imports
         """
 
         self.component.constinstdir()
@@ -75,9 +78,17 @@ class TestOneInstalledComponent(unittest.TestCase):
                 script = self.component.toolbox.envscript()
                 if os.path.exists(script.replace('/pro/', ki.__version__)):
                     script = script.replace('/pro/', ki.__version__) + " " + ki.__version__
-                newtuple = ki.mycmd("bash -c 'source "
-                                    + script
-                                    + " > /dev/null ;" + cmd + ";'")
+                modules = ki.importcheck(cmd)
+                if modules is not None and ttuple[1:] == (0, b'', b''):
+                    found = ki.probe_imports(self.modules + modules, script)
+                    errors = [m + ": " + found[m]['error'] for m in modules if not found[m]['ok']]
+                    newtuple = (0, b'', b'')
+                    if len(errors):
+                        newtuple = (1, b'', '\n'.join(errors).encode('utf-8'))
+                else:
+                    newtuple = ki.mycmd("bash -c 'source "
+                                        + script
+                                        + " > /dev/null ;" + cmd + ";'")
                 self.assertEquals(ttuple[1:], newtuple, self.component.cname
                                   + ": Unexpected failure with component " + self.component.cname
                                   + ": \n - I was expecting:\n\t" + cmd + ttuple[1:].__str__()
@@ -98,6 +109,10 @@ if __name__ == "__main__":
             sys.argv = [s for s in sys.argv if s != skind]
     requested_comps = [a for a in sys.argv[1:] if not a.startswith("-")]
     everything = kcf.pick_components(requested_comps)
+    for c in everything:
+        if getattr(c, kind) and c.doInstall:
+            for t in c.tests:
+                TestOneInstalledComponent.modules.extend(ki.importcheck(c.knownreplaces(t[0])) or [])
     # little constructor to make a test with the same name as the component
     for c in everything:
         ct = None